@@ -15,5 +15,8 @@ fi
 
 /bin/cp -up /ocean-provider/artifacts/* /usr/local/artifacts/ 2>/dev/null || true
 
-gunicorn -b ${OCEAN_PROVIDER_URL#*://} -w ${OCEAN_PROVIDER_WORKERS} -t ${OCEAN_PROVIDER_TIMEOUT} ocean_provider.run:app
+gunicorn -b ${OCEAN_PROVIDER_URL#*://} -w ${OCEAN_PROVIDER_WORKERS} \
+  -k ${OCEAN_PROVIDER_WORKER_CLASS:-sync} \
+  --worker-connections ${OCEAN_PROVIDER_WORKER_CONNECTIONS:-1000} \
+  -t ${OCEAN_PROVIDER_TIMEOUT} ocean_provider.run:app
 tail -f /dev/null
@@ -0,0 +1,72 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from ocean_provider.util import (
+    decrypt_assets_files,
+    get_asset_urls,
+    get_download_url,
+    get_metadata_url,
+)
+from ocean_provider.utils.basics import get_asset_from_metadatastore
+
+
+class AssetContext:
+    """Request scoped memo of assets and their decrypted urls.
+
+    A compute request reaches the same DIDs from several validators and from
+    the algorithm serializer. Sharing one context between them makes sure
+    each DID is fetched and decrypted at most once per request.
+    """
+
+    def __init__(self, provider_wallet, config_file):
+        self.provider_wallet = provider_wallet
+        self.config_file = config_file
+        self._assets = {}
+        self._urls = {}
+        self._download_urls = {}
+
+    def get_asset(self, did):
+        if did not in self._assets:
+            self._assets[did] = get_asset_from_metadatastore(get_metadata_url(), did)
+
+        return self._assets[did]
+
+    def prefetch(self, dids):
+        """Fetches the assets for `dids` and decrypts their files in one batch.
+
+        Lookup errors are ignored here, they surface again (and are reported
+        to the user) when the validators ask for the asset.
+        """
+        assets = []
+        for did in filter(None, dids):
+            try:
+                assets.append(self.get_asset(did))
+            except Exception:
+                continue
+
+        decrypt_assets_files(assets, self.provider_wallet)
+
+    def get_asset_urls(self, asset):
+        if asset.did not in self._urls:
+            self._urls[asset.did] = get_asset_urls(asset, self.provider_wallet)
+
+        return self._urls[asset.did]
+
+    def get_asset_url_at_index(self, url_index, asset):
+        files_list = self.get_asset_urls(asset)
+        if not files_list:
+            return None
+        if url_index >= len(files_list):
+            raise ValueError(f'url index "{url_index}"" is invalid.')
+
+        return files_list[url_index]
+
+    def get_asset_download_urls(self, asset):
+        if asset.did not in self._download_urls:
+            self._download_urls[asset.did] = [
+                get_download_url(url, self.config_file)
+                for url in self.get_asset_urls(asset)
+            ]
+
+        return self._download_urls[asset.did]
@@ -0,0 +1,191 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ocean_provider import models
+from ocean_provider.database import SessionLocal
+from ocean_provider.exceptions import ChecksumJobQueueFullError
+from ocean_provider.util_url import compute_url_checksums
+from ocean_provider.utils.basics import get_config
+
+logger = logging.getLogger(__name__)
+
+# progress is written to the database at most this often (seconds)
+PROGRESS_INTERVAL = 1
+# running jobs without progress for this long are reported as failed
+STALE_JOB_TIMEOUT = 5 * 60
+# finished jobs are deleted after this many seconds
+JOB_RETENTION = 24 * 60 * 60
+
+_executor = None
+# slots of the jobs waiting for a worker of this process
+_pending_slots = None
+_executor_lock = threading.Lock()
+
+
+def start_checksum_job(url, checksum_types=("sha256",)):
+    """
+    Schedules the checksums of `url` for each of the `checksum_types` in the
+    background, returns the job id.
+
+    Jobs are kept in the provider database, so their status can be read
+    from any worker process. The active job for the same url and checksum
+    types is returned instead of starting another one, and
+    ChecksumJobQueueFullError is raised when `checksum_jobs.max_pending` jobs
+    are already waiting for a worker.
+    """
+    url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    checksum_types = ",".join(sorted(set(checksum_types)))
+    now = time.time()
+    executor = _get_executor()
+    session = SessionLocal()
+    try:
+        session.query(models.ChecksumJob).filter(
+            models.ChecksumJob.updated_at < now - JOB_RETENTION
+        ).delete()
+        session.commit()
+        job = (
+            session.query(models.ChecksumJob)
+            .filter(
+                models.ChecksumJob.url_hash == url_hash,
+                models.ChecksumJob.checksum_types == checksum_types,
+                models.ChecksumJob.status.in_(
+                    [models.ChecksumJob.PENDING, models.ChecksumJob.RUNNING]
+                ),
+                models.ChecksumJob.updated_at >= now - STALE_JOB_TIMEOUT,
+            )
+            .first()
+        )
+        if job:
+            return job.job_id
+
+        if not _pending_slots.acquire(blocking=False):
+            raise ChecksumJobQueueFullError(
+                "Too many checksum jobs are pending, try again later."
+            )
+
+        job_id = str(uuid.uuid4())
+        try:
+            session.add(
+                models.ChecksumJob(
+                    job_id=job_id,
+                    url_hash=url_hash,
+                    checksum_types=checksum_types,
+                    status=models.ChecksumJob.PENDING,
+                    bytes_hashed=0,
+                    started_at=now,
+                    updated_at=now,
+                )
+            )
+            session.commit()
+            executor.submit(_run_checksum_job, job_id, url, checksum_types.split(","))
+        except BaseException:
+            _pending_slots.release()
+            raise
+    finally:
+        session.close()
+
+    return job_id
+
+
+def get_checksum_job(job_id):
+    """Returns the status of a checksum job as a dict, None if unknown."""
+    session = SessionLocal()
+    try:
+        job = session.query(models.ChecksumJob).filter_by(job_id=job_id).first()
+    finally:
+        session.close()
+
+    if not job:
+        return None
+
+    status, error = job.status, job.error
+    if (
+        status in (models.ChecksumJob.PENDING, models.ChecksumJob.RUNNING)
+        and time.time() - job.updated_at > STALE_JOB_TIMEOUT
+    ):
+        status, error = models.ChecksumJob.FAILED, "Job was interrupted."
+
+    # time spent waiting for a worker does not count
+    elapsed = job.updated_at - job.running_at if job.running_at else 0
+    return {
+        "jobId": job.job_id,
+        "status": status,
+        "bytesHashed": job.bytes_hashed,
+        "totalBytes": job.total_bytes,
+        "throughput": int(job.bytes_hashed / elapsed) if elapsed > 0 else 0,
+        "checksums": job.checksums,
+        "error": error,
+    }
+
+
+def _get_executor():
+    global _executor, _pending_slots
+    with _executor_lock:
+        if _executor is None:
+            config = get_config()
+            _pending_slots = threading.BoundedSemaphore(
+                config.checksum_jobs_max_pending
+            )
+            _executor = ThreadPoolExecutor(
+                max_workers=config.checksum_jobs_workers,
+                thread_name_prefix="checksum",
+            )
+
+    return _executor
+
+
+def _update_job(job_id, **values):
+    session = SessionLocal()
+    try:
+        session.query(models.ChecksumJob).filter_by(job_id=job_id).update(
+            dict(values, updated_at=time.time())
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def _run_checksum_job(job_id, url, checksum_types):
+    _pending_slots.release()
+    last_update = None
+
+    def _on_progress(response, bytes_hashed):
+        nonlocal last_update
+        if last_update and time.monotonic() - last_update < PROGRESS_INTERVAL:
+            return
+
+        last_update = time.monotonic()
+        try:
+            content_length = response.headers.get("Content-Length")
+            _update_job(
+                job_id,
+                bytes_hashed=bytes_hashed,
+                total_bytes=int(content_length) if content_length else None,
+            )
+        except Exception as e:
+            # progress is informative, the job goes on
+            logger.warning(f"Cannot update progress of checksum job {job_id}: {e}")
+
+    try:
+        _update_job(job_id, status=models.ChecksumJob.RUNNING, running_at=time.time())
+        _, checksums, bytes_hashed = compute_url_checksums(
+            url, checksum_types=checksum_types, progress_callback=_on_progress
+        )
+        _update_job(
+            job_id,
+            status=models.ChecksumJob.DONE,
+            checksums=checksums,
+            bytes_hashed=bytes_hashed,
+            total_bytes=bytes_hashed,
+        )
+    except Exception as e:
+        logger.error(f"Checksum job {job_id} failed: {e}")
+        _update_job(job_id, status=models.ChecksumJob.FAILED, error=str(e)[:255])
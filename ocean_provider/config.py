@@ -11,6 +11,7 @@ import configparser
 import logging
 import os
 from pathlib import Path
+from urllib.parse import urlparse
 
 NAME_NETWORK_URL = "network"
 NAME_ARTIFACTS_PATH = "artifacts.path"
@@ -23,6 +24,34 @@ NAME_PROVIDER_ADDRESS = "provider.address"
 NAME_OPERATOR_SERVICE_URL = "operator_service.url"
 NAME_ALLOW_NON_PUBLIC_IP = "allow_non_public_ip"
 NAME_STORAGE_PATH = "storage.path"
+NAME_DDO_CACHE_TTL = "ddo_cache.ttl"
+NAME_DDO_CACHE_NEGATIVE_TTL = "ddo_cache.negative_ttl"
+NAME_DDO_CACHE_MAX_ENTRIES = "ddo_cache.max_entries"
+NAME_DECRYPTED_FILES_CACHE_MAX_ENTRIES = "decrypted_files_cache.max_entries"
+NAME_CRYPTO_WORKERS = "crypto.workers"
+NAME_ENCRYPT_MAX_BATCH_SIZE = "encrypt.max_batch_size"
+NAME_SIGNED_URL_CACHE_MAX_ENTRIES = "signed_url_cache.max_entries"
+NAME_DNS_CACHE_MAX_ENTRIES = "dns_cache.max_entries"
+NAME_DNS_CACHE_NEGATIVE_TTL = "dns_cache.negative_ttl"
+NAME_FILEINFO_CONCURRENCY = "fileinfo.concurrency"
+NAME_FILEINFO_TIMEOUT = "fileinfo.timeout"
+NAME_CHECKSUM_JOBS_WORKERS = "checksum_jobs.workers"
+NAME_CHECKSUM_JOBS_MAX_PENDING = "checksum_jobs.max_pending"
+NAME_DOWNLOAD_CHUNK_SIZE = "download.chunk_size"
+NAME_DOWNLOAD_MAX_CHUNK_SIZE = "download.max_chunk_size"
+NAME_DOWNLOAD_CONNECT_TIMEOUT = "download.connect_timeout"
+NAME_DOWNLOAD_READ_TIMEOUT = "download.read_timeout"
+NAME_DOWNLOAD_MAX_DURATION = "download.max_duration"
+NAME_DOWNLOAD_MIN_SPEED = "download.min_speed"
+NAME_DOWNLOAD_SEGMENTS = "download.segments"
+NAME_DOWNLOAD_SEGMENT_THRESHOLD = "download.segment_threshold"
+NAME_DOWNLOAD_SEGMENT_SIZE = "download.segment_size"
+NAME_DOWNLOAD_SEGMENT_WORKERS = "download.segment_workers"
+NAME_DOWNLOAD_CACHE_PATH = "download_cache.path"
+NAME_DOWNLOAD_CACHE_MAX_SIZE = "download_cache.max_size"
+
+# per storage host "connect,read" timeouts, keyed by a suffix of the host name
+DOWNLOAD_TIMEOUTS_SECTION = "download_timeouts"
 
 environ_names = {
     NAME_NETWORK_URL: [
@@ -62,6 +91,131 @@ environ_names = {
         "resources",
     ],
     NAME_STORAGE_PATH: ["STORAGE_PATH", "Path to the local database file", "resources"],
+    NAME_DDO_CACHE_TTL: [
+        "DDO_CACHE_TTL",
+        "Seconds a DDO fetched from the metadata store is cached",
+        "resources",
+    ],
+    NAME_DDO_CACHE_NEGATIVE_TTL: [
+        "DDO_CACHE_NEGATIVE_TTL",
+        "Seconds a DDO not found by the metadata store (404) is cached",
+        "resources",
+    ],
+    NAME_DDO_CACHE_MAX_ENTRIES: [
+        "DDO_CACHE_MAX_ENTRIES",
+        "Maximum number of cached DDOs, 0 disables the cache",
+        "resources",
+    ],
+    NAME_DECRYPTED_FILES_CACHE_MAX_ENTRIES: [
+        "DECRYPTED_FILES_CACHE_MAX_ENTRIES",
+        "Maximum number of decrypted asset files lists kept in memory",
+        "resources",
+    ],
+    NAME_CRYPTO_WORKERS: [
+        "CRYPTO_WORKERS",
+        "Processes used for batched encryption/decryption (0 = inline, auto = cpu count)",
+        "resources",
+    ],
+    NAME_ENCRYPT_MAX_BATCH_SIZE: [
+        "ENCRYPT_MAX_BATCH_SIZE",
+        "Maximum number of documents accepted by the batch encrypt endpoint",
+        "resources",
+    ],
+    NAME_SIGNED_URL_CACHE_MAX_ENTRIES: [
+        "SIGNED_URL_CACHE_MAX_ENTRIES",
+        "Maximum number of download urls generated by Osmosis kept in memory",
+        "resources",
+    ],
+    NAME_DNS_CACHE_MAX_ENTRIES: [
+        "DNS_CACHE_MAX_ENTRIES",
+        "Maximum number of cached DNS answers",
+        "resources",
+    ],
+    NAME_DNS_CACHE_NEGATIVE_TTL: [
+        "DNS_CACHE_NEGATIVE_TTL",
+        "Seconds a NXDOMAIN or empty DNS answer is cached",
+        "resources",
+    ],
+    NAME_FILEINFO_CONCURRENCY: [
+        "FILEINFO_CONCURRENCY",
+        "Number of threads checking the urls of fileinfo requests, per process",
+        "resources",
+    ],
+    NAME_FILEINFO_TIMEOUT: [
+        "FILEINFO_TIMEOUT",
+        "Seconds the fileinfo endpoint waits for all url checks (0 = no limit)",
+        "resources",
+    ],
+    NAME_CHECKSUM_JOBS_WORKERS: [
+        "CHECKSUM_JOBS_WORKERS",
+        "Number of background threads computing checksum jobs",
+        "resources",
+    ],
+    NAME_CHECKSUM_JOBS_MAX_PENDING: [
+        "CHECKSUM_JOBS_MAX_PENDING",
+        "Maximum number of checksum jobs waiting for a worker",
+        "resources",
+    ],
+    NAME_DOWNLOAD_CHUNK_SIZE: [
+        "DOWNLOAD_CHUNK_SIZE",
+        "Initial size in bytes of the chunks streamed by the download proxy",
+        "resources",
+    ],
+    NAME_DOWNLOAD_MAX_CHUNK_SIZE: [
+        "DOWNLOAD_MAX_CHUNK_SIZE",
+        "Size in bytes the download chunks can grow to on fast sources",
+        "resources",
+    ],
+    NAME_DOWNLOAD_CONNECT_TIMEOUT: [
+        "DOWNLOAD_CONNECT_TIMEOUT",
+        "Seconds to wait for a connection to the storage of a file",
+        "resources",
+    ],
+    NAME_DOWNLOAD_READ_TIMEOUT: [
+        "DOWNLOAD_READ_TIMEOUT",
+        "Seconds to wait for data from the storage of a file",
+        "resources",
+    ],
+    NAME_DOWNLOAD_MAX_DURATION: [
+        "DOWNLOAD_MAX_DURATION",
+        "Seconds a proxied download can last (0 = no limit)",
+        "resources",
+    ],
+    NAME_DOWNLOAD_MIN_SPEED: [
+        "DOWNLOAD_MIN_SPEED",
+        "Bytes per second below which a proxied download is aborted (0 = no limit)",
+        "resources",
+    ],
+    NAME_DOWNLOAD_SEGMENTS: [
+        "DOWNLOAD_SEGMENTS",
+        "Concurrent range requests fetching a large file (0 = one stream)",
+        "resources",
+    ],
+    NAME_DOWNLOAD_SEGMENT_THRESHOLD: [
+        "DOWNLOAD_SEGMENT_THRESHOLD",
+        "Size in bytes from which files are fetched in segments",
+        "resources",
+    ],
+    NAME_DOWNLOAD_SEGMENT_SIZE: [
+        "DOWNLOAD_SEGMENT_SIZE",
+        "Size in bytes of each range request of a segmented download",
+        "resources",
+    ],
+    NAME_DOWNLOAD_SEGMENT_WORKERS: [
+        "DOWNLOAD_SEGMENT_WORKERS",
+        "Number of threads fetching the segments of all downloads, per process",
+        "resources",
+    ],
+    NAME_DOWNLOAD_CACHE_PATH: [
+        "DOWNLOAD_CACHE_PATH",
+        "Directory caching downloaded files (empty = no cache)",
+        "resources",
+    ],
+    NAME_DOWNLOAD_CACHE_MAX_SIZE: [
+        "DOWNLOAD_CACHE_MAX_SIZE",
+        "Size in bytes the download cache directory can grow to",
+        "resources",
+    ],
 }
 
 
@@ -106,6 +260,44 @@ class Config(configparser.ConfigParser):
 
         self._load_environ()
 
+    def freeze(self):
+        """Makes this instance read-only, e.g. when shared as a process-wide snapshot."""
+        self._frozen = True
+
+    def _check_mutable(self):
+        if getattr(self, "_frozen", False):
+            raise TypeError(
+                "Config snapshot is read-only, use `reload_config()` to refresh it."
+            )
+
+    def set(self, section, option, value=None):
+        self._check_mutable()
+        super().set(section, option, value)
+
+    def add_section(self, section):
+        self._check_mutable()
+        super().add_section(section)
+
+    def remove_section(self, section):
+        self._check_mutable()
+        return super().remove_section(section)
+
+    def remove_option(self, section, option):
+        self._check_mutable()
+        return super().remove_option(section, option)
+
+    def read(self, filenames, encoding=None):
+        self._check_mutable()
+        return super().read(filenames, encoding=encoding)
+
+    def read_file(self, f, source=None):
+        self._check_mutable()
+        super().read_file(f, source=source)
+
+    def read_dict(self, dictionary, source="<dict>"):
+        self._check_mutable()
+        super().read_dict(dictionary, source=source)
+
     def _load_environ(self):
         for option_name, environ_item in environ_names.items():
             value = os.environ.get(environ_item[0])
@@ -113,6 +305,14 @@ class Config(configparser.ConfigParser):
                 self._logger.debug(f"Config: setting environ {option_name} = {value}")
                 self.set(environ_item[2], option_name, value)
 
+    def _get_int(self, section, option, fallback):
+        value = self.get(section, option, fallback=None)
+        return int(value) if value else fallback
+
+    def _get_float(self, section, option, fallback):
+        value = self.get(section, option, fallback=None)
+        return float(value) if value else fallback
+
     @property
     def artifacts_path(self):
         """Path where the eth-network artifacts are allocated."""
@@ -167,3 +367,137 @@ class Config(configparser.ConfigParser):
         result = self.get("resources", NAME_STORAGE_PATH, fallback=fallback)
 
         return result if result else fallback
+
+    @property
+    def ddo_cache_ttl(self):
+        """Seconds a DDO fetched from the metadata store is reused."""
+        return self._get_float("resources", NAME_DDO_CACHE_TTL, 60)
+
+    @property
+    def ddo_cache_negative_ttl(self):
+        """Seconds a DDO not found (a 404 from Aquarius) is remembered."""
+        return self._get_float("resources", NAME_DDO_CACHE_NEGATIVE_TTL, 5)
+
+    @property
+    def ddo_cache_max_entries(self):
+        return self._get_int("resources", NAME_DDO_CACHE_MAX_ENTRIES, 1000)
+
+    @property
+    def decrypted_files_cache_max_entries(self):
+        return self._get_int("resources", NAME_DECRYPTED_FILES_CACHE_MAX_ENTRIES, 1000)
+
+    @property
+    def crypto_workers(self):
+        """Size of the process pool used for batched ECIES operations.
+
+        0 (the default) runs them inline, `auto` uses one process per core.
+        """
+        value = self.get("resources", NAME_CRYPTO_WORKERS, fallback=None)
+        if value == "auto":
+            return os.cpu_count() or 1
+
+        return int(value) if value else 0
+
+    @property
+    def encrypt_max_batch_size(self):
+        return self._get_int("resources", NAME_ENCRYPT_MAX_BATCH_SIZE, 500)
+
+    @property
+    def signed_url_cache_max_entries(self):
+        return self._get_int("resources", NAME_SIGNED_URL_CACHE_MAX_ENTRIES, 1000)
+
+    @property
+    def dns_cache_max_entries(self):
+        return self._get_int("resources", NAME_DNS_CACHE_MAX_ENTRIES, 1000)
+
+    @property
+    def dns_cache_negative_ttl(self):
+        return self._get_float("resources", NAME_DNS_CACHE_NEGATIVE_TTL, 30)
+
+    @property
+    def fileinfo_concurrency(self):
+        return self._get_int("resources", NAME_FILEINFO_CONCURRENCY, 8)
+
+    @property
+    def fileinfo_timeout(self):
+        """Overall deadline of the fileinfo url checks, None when unlimited."""
+        return self._get_float("resources", NAME_FILEINFO_TIMEOUT, 0) or None
+
+    @property
+    def checksum_jobs_workers(self):
+        return self._get_int("resources", NAME_CHECKSUM_JOBS_WORKERS, 2)
+
+    @property
+    def checksum_jobs_max_pending(self):
+        return self._get_int("resources", NAME_CHECKSUM_JOBS_MAX_PENDING, 100)
+
+    @property
+    def download_chunk_size(self):
+        return self._get_int("resources", NAME_DOWNLOAD_CHUNK_SIZE, 64 * 1024)
+
+    @property
+    def download_max_chunk_size(self):
+        return self._get_int("resources", NAME_DOWNLOAD_MAX_CHUNK_SIZE, 1024 * 1024)
+
+    @property
+    def download_max_duration(self):
+        """Deadline in seconds of a whole download, None when unlimited."""
+        return self._get_float("resources", NAME_DOWNLOAD_MAX_DURATION, 0) or None
+
+    @property
+    def download_min_speed(self):
+        """Minimum upstream throughput in bytes per second, None when unchecked."""
+        return self._get_float("resources", NAME_DOWNLOAD_MIN_SPEED, 0) or None
+
+    @property
+    def download_segments(self):
+        return self._get_int("resources", NAME_DOWNLOAD_SEGMENTS, 0)
+
+    @property
+    def download_segment_threshold(self):
+        return self._get_int(
+            "resources", NAME_DOWNLOAD_SEGMENT_THRESHOLD, 64 * 1024 * 1024
+        )
+
+    @property
+    def download_segment_size(self):
+        return self._get_int("resources", NAME_DOWNLOAD_SEGMENT_SIZE, 8 * 1024 * 1024)
+
+    @property
+    def download_segment_workers(self):
+        return self._get_int("resources", NAME_DOWNLOAD_SEGMENT_WORKERS, 16)
+
+    @property
+    def download_cache_path(self):
+        """Directory of the download cache, empty when the cache is disabled."""
+        return self.get("resources", NAME_DOWNLOAD_CACHE_PATH, fallback="")
+
+    @property
+    def download_cache_max_size(self):
+        return self._get_int(
+            "resources", NAME_DOWNLOAD_CACHE_MAX_SIZE, 10 * 1024 * 1024 * 1024
+        )
+
+    def get_download_timeouts(self, url):
+        """
+        Returns the (connect, read) timeouts for requests to `url`. Hosts
+        ending with a key of the [download_timeouts] section use its
+        "connect,read" (or single) value, the longest matching key wins.
+        Other hosts use download.connect_timeout and download.read_timeout.
+        """
+        host = (urlparse(url).hostname or "").lower()
+        if self.has_section(DOWNLOAD_TIMEOUTS_SECTION):
+            suffixes = [
+                suffix
+                for suffix in self.options(DOWNLOAD_TIMEOUTS_SECTION)
+                if f".{host}".endswith("." + suffix.lstrip("."))
+            ]
+            if suffixes:
+                value = self.get(DOWNLOAD_TIMEOUTS_SECTION, max(suffixes, key=len))
+                timeouts = [float(timeout) for timeout in value.split(",")]
+                return timeouts[0], timeouts[-1]
+
+        return (
+            self._get_float("resources", NAME_DOWNLOAD_CONNECT_TIMEOUT, 3),
+            self._get_float("resources", NAME_DOWNLOAD_READ_TIMEOUT, 3),
+        )
@@ -0,0 +1,109 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import io
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from ocean_provider.exceptions import DownloadAbortedError
+
+ARCHIVE_CONTENT_TYPES = {"zip": "application/zip", "tar": "application/x-tar"}
+
+
+class _ArchiveBuffer(io.RawIOBase):
+    """Unseekable file collecting what an archive writer writes to it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        """Returns and forgets everything written since the last call."""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip_chunks(files):
+    """
+    Yields a zip archive of `files`, an iterable of (name, size, chunks)
+    tuples, where size is None when it is not known in advance. Files are
+    stored uncompressed and the archive is written as a stream, with the
+    sizes and checksums after the data of each file, so only the current
+    chunk is held in memory.
+    """
+    buffer = _ArchiveBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, size, chunks in files:
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            if size is not None:
+                info.file_size = size
+            # zip64 records are needed for large files of unknown size
+            with archive.open(info, "w", force_zip64=size is None) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def iter_tar_chunks(files):
+    """
+    Yields a tar archive of `files`, an iterable of (name, size, chunks)
+    tuples. The size of each file goes in the header before its data, files
+    of unknown size are first written to a temporary file to get it.
+    """
+    mtime = time.time()
+    for name, size, chunks in files:
+        if size is not None:
+            yield from _iter_tar_member(name, size, chunks, mtime)
+            continue
+
+        with tempfile.TemporaryFile() as spool:
+            read_size = 0
+            for chunk in chunks:
+                read_size = max(read_size, len(chunk))
+                spool.write(chunk)
+            size = spool.tell()
+            spool.seek(0)
+            spooled_chunks = iter(lambda: spool.read(read_size or 1), b"")
+            yield from _iter_tar_member(name, size, spooled_chunks, mtime)
+
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def _iter_tar_member(name, size, chunks, mtime):
+    """
+    Yields the header, data and padding of a tar member, raises
+    DownloadAbortedError when `chunks` are not `size` bytes long.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    yield info.tobuf(tarfile.PAX_FORMAT)
+
+    written = 0
+    for chunk in chunks:
+        written += len(chunk)
+        if written > size:
+            break
+        yield chunk
+    if written != size:
+        raise DownloadAbortedError(
+            f"Size of {name} is not {size} bytes, the file may have changed."
+        )
+
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
@@ -0,0 +1,216 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from ocean_provider.url_checksum import get_validators
+from ocean_provider.utils.basics import LocalFileAdapter, get_config
+
+logger = logging.getLogger(__name__)
+
+# headers of the upstream response kept with the cached body
+CACHED_HEADERS = ("Content-Type", "Content-Disposition", "ETag", "Last-Modified")
+# temporary and unreferenced files untouched for this long (seconds) are
+# leftovers of interrupted stores
+STALE_FILE_AGE = 60 * 60
+
+_download_cache = None
+_download_cache_lock = threading.Lock()
+
+
+class DownloadCache:
+    """Read-through cache of downloaded files in the `path` directory.
+
+    Each entry is a `<key>.json` file describing the upstream response and
+    pointing to the data file holding its body. Bodies are written while they
+    are streamed to the first client and only added once complete, so they
+    can be shared by all the provider processes. The least recently used
+    entries are removed when the directory grows over `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._adapter = LocalFileAdapter()
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, url):
+        """Returns the entry cached for `url`, None if there is none."""
+        try:
+            with open(self._entry_path(url)) as file:
+                entry = json.load(file)
+            os.utime(os.path.join(self.path, entry["data"]))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        entry["validators"] = tuple(entry["validators"])
+        return entry
+
+    def open(self, entry, range_header=None):
+        """Returns a file response with the body of `entry`, honouring ranges."""
+        request = requests.Request(
+            "GET",
+            "file://" + os.path.join(self.path, entry["data"]),
+            headers={"Range": range_header} if range_header else {},
+        ).prepare()
+        response = self._adapter.send(request)
+        for header, value in entry["headers"].items():
+            # multipart range responses keep their own Content-Type
+            response.headers.setdefault(header, value)
+        return response
+
+    def remove(self, url):
+        """Removes the entry of `url` and its body."""
+        try:
+            with open(self._entry_path(url)) as file:
+                data = json.load(file)["data"]
+            os.remove(self._entry_path(url))
+            os.remove(os.path.join(self.path, data))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def is_cacheable(self, response):
+        """Complete, unencoded bodies with validators and a known size."""
+        validators = get_validators(response.headers)
+        return (
+            response.status_code == 200
+            and validators is not None
+            and validators[2] is not None
+            and validators[2].isdigit()
+            and int(validators[2]) <= self.max_size
+            and not response.headers.get("Content-Encoding")
+        )
+
+    def store(self, url, response, chunks):
+        """
+        Yields the `chunks` of the body of `response` while writing them to
+        the cache. The entry for `url` is added once the whole body was read.
+        Cache write errors only stop the caching, never the download.
+        """
+        validators = get_validators(response.headers)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        file = os.fdopen(fd, "wb")
+        size = 0
+        try:
+            for chunk in chunks:
+                if file:
+                    try:
+                        file.write(chunk)
+                        size += len(chunk)
+                    except OSError as e:
+                        logger.warning(f"Download cache write failed: {e}")
+                        file.close()
+                        file = None
+                yield chunk
+
+            if file:
+                file.close()
+                file = None
+                if size == int(validators[2]):
+                    self._add(url, response, validators, tmp_path)
+        finally:
+            if file:
+                file.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _add(self, url, response, validators, tmp_path):
+        version = hashlib.sha256(json.dumps(validators).encode("utf-8")).hexdigest()
+        data = f"{_get_key(url)}-{version[:16]}.data"
+        os.replace(tmp_path, os.path.join(self.path, data))
+
+        entry = {
+            "data": data,
+            "validators": validators,
+            "headers": {
+                header: response.headers[header]
+                for header in CACHED_HEADERS
+                if header in response.headers
+            },
+        }
+        fd, tmp_entry_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(entry, file)
+        previous = self.get(url)
+        os.replace(tmp_entry_path, self._entry_path(url))
+        if previous and previous["data"] != data:
+            try:
+                os.remove(os.path.join(self.path, previous["data"]))
+            except OSError:
+                pass
+
+        self._evict()
+
+    def _evict(self):
+        names = os.listdir(self.path)
+        entries = []
+        referenced = set()
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            entry_path = os.path.join(self.path, name)
+            try:
+                with open(entry_path) as file:
+                    data = json.load(file)["data"]
+                stat = os.stat(os.path.join(self.path, data))
+            except (OSError, ValueError, KeyError):
+                continue
+            referenced.add(data)
+            entries.append(
+                (stat.st_mtime, stat.st_size, entry_path, os.path.join(self.path, data))
+            )
+
+        total_size = sum(size for _, size, _, _ in entries)
+        now = time.time()
+        for name in names:
+            if name in referenced or not name.endswith((".data", ".tmp")):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > STALE_FILE_AGE:
+                    os.remove(path)
+                else:
+                    # stores in progress
+                    total_size += stat.st_size
+            except OSError:
+                pass
+
+        for _, size, entry_path, data_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for path in (entry_path, data_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def _entry_path(self, url):
+        return os.path.join(self.path, f"{_get_key(url)}.json")
+
+
+def _get_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def get_download_cache():
+    """Returns the download cache, None when download_cache.path is not set."""
+    global _download_cache
+    path = get_config().download_cache_path
+    if not path:
+        return None
+
+    with _download_cache_lock:
+        if _download_cache is None or _download_cache.path != path:
+            _download_cache = DownloadCache(path, get_config().download_cache_max_size)
+
+    return _download_cache
@@ -4,3 +4,11 @@
 #
 class InvalidSignatureError(Exception):
     """ User signature is not valid."""
+
+
+class DownloadAbortedError(Exception):
+    """Proxied download exceeded its deadline or fell below the minimum speed."""
+
+
+class ChecksumJobQueueFullError(Exception):
+    """Too many checksum jobs are waiting for a worker."""
@@ -2,7 +2,7 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
-from sqlalchemy import Column, String
+from sqlalchemy import JSON, BigInteger, Column, Float, String
 
 from .database import Base
 
@@ -13,3 +13,47 @@ class UserNonce(Base):
 
     address = Column(String(255), nullable=False, primary_key=True, autoincrement=False)
     nonce = Column(String(255), nullable=False)
+
+
+class UrlChecksum(Base):
+    """Checksum of a remote file, valid while its validator headers match.
+
+    Urls may be confidential (e.g. decrypted asset urls), so only their
+    sha256 is stored.
+    """
+
+    __tablename__ = "url_checksum"
+
+    url_hash = Column(String(64), nullable=False, primary_key=True)
+    checksum_type = Column(String(32), nullable=False, primary_key=True)
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(255), nullable=True)
+    content_length = Column(String(255), nullable=True)
+    checksum = Column(String(255), nullable=False)
+
+
+class ChecksumJob(Base):
+    """Progress and result of a checksum computed in the background.
+
+    Like for UrlChecksum, only the sha256 of the url is stored.
+    """
+
+    __tablename__ = "checksum_job"
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    job_id = Column(String(36), nullable=False, primary_key=True)
+    url_hash = Column(String(64), nullable=False, index=True)
+    # comma separated, sorted
+    checksum_types = Column(String(255), nullable=False)
+    status = Column(String(32), nullable=False)
+    bytes_hashed = Column(BigInteger, nullable=False, default=0)
+    total_bytes = Column(BigInteger, nullable=True)
+    started_at = Column(Float, nullable=False)
+    running_at = Column(Float, nullable=True)
+    updated_at = Column(Float, nullable=False)
+    # checksum of the file for each requested checksum type
+    checksums = Column(JSON, nullable=True)
+    error = Column(String(255), nullable=True)
@@ -21,6 +21,43 @@ with engine.connect() as con:
         )
         """
     )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS url_checksum (
+          url_hash VARCHAR(64) NOT NULL,
+          checksum_type VARCHAR(32) NOT NULL,
+          etag VARCHAR(255),
+          last_modified VARCHAR(255),
+          content_length VARCHAR(255),
+          checksum VARCHAR(255) NOT NULL,
+          PRIMARY KEY (url_hash, checksum_type)
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checksum_job (
+          job_id VARCHAR(36) NOT NULL,
+          url_hash VARCHAR(64) NOT NULL,
+          checksum_types VARCHAR(255) NOT NULL,
+          status VARCHAR(32) NOT NULL,
+          bytes_hashed BIGINT NOT NULL,
+          total_bytes BIGINT,
+          started_at FLOAT NOT NULL,
+          running_at FLOAT,
+          updated_at FLOAT NOT NULL,
+          checksums JSON,
+          error VARCHAR(255),
+          PRIMARY KEY (job_id)
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_checksum_job_url_hash
+        ON checksum_job (url_hash)
+        """
+    )
 
 app = Flask(__name__)
 CORS(app)
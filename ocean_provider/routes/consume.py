@@ -10,13 +10,17 @@ from eth_utils import add_0x_prefix
 from flask import Response, jsonify, request
 from flask_sieve import validate
 from ocean_lib.models.data_token import DataToken
+from ocean_provider.checksum_jobs import get_checksum_job, start_checksum_job
+from ocean_provider.exceptions import ChecksumJobQueueFullError
 from ocean_provider.log import setup_logging
 from ocean_provider.myapp import app
 from ocean_provider.user_nonce import get_nonce, increment_nonce
 from ocean_provider.util import (
+    build_archive_response,
     build_download_response,
     get_asset_download_urls,
     get_asset_url_at_index,
+    get_asset_urls,
     get_compute_address,
     get_download_url,
     get_metadata_url,
@@ -26,17 +30,25 @@ from ocean_provider.util import (
     validate_order,
     validate_transfer_not_used_for_other_service,
 )
-from ocean_provider.util_url import check_url_details
+from ocean_provider.util_url import (
+    SUPPORTED_CHECKSUM_TYPES,
+    SafeAddressAdapter,
+    check_url_details,
+    check_urls_details,
+)
 from ocean_provider.utils.basics import (
     LocalFileAdapter,
     get_asset_from_metadatastore,
+    get_config,
     get_datatoken_minter,
     get_provider_wallet,
     setup_network,
 )
-from ocean_provider.utils.encryption import do_encrypt
+from ocean_provider.utils.encryption import do_encrypt, do_encrypt_many
 from ocean_provider.validation.requests import (
+    ChecksumJobRequest,
     DownloadRequest,
+    EncryptBatchRequest,
     EncryptRequest,
     FileInfoRequest,
     InitializeRequest,
@@ -54,6 +66,13 @@ setup_network()
 provider_wallet = get_provider_wallet()
 requests_session = get_requests_session()
 requests_session.mount("file://", LocalFileAdapter())
+# downloads connect to the addresses validated by the url safety check
+requests_session.mount(
+    "http://", SafeAddressAdapter(pool_connections=25, pool_maxsize=25)
+)
+requests_session.mount(
+    "https://", SafeAddressAdapter(pool_connections=25, pool_maxsize=25)
+)
 
 logger = logging.getLogger(__name__)
 
@@ -192,6 +211,134 @@ def encrypt():
         return jsonify(error=str(e)), 500
 
 
+@services.route("/encrypt/batch", methods=["POST"])
+@validate(EncryptBatchRequest)
+def encryptBatch():
+    """Encrypt several documents in one call, see the `encrypt` endpoint.
+    This is meant for publishers registering many assets at once: the
+    documents are encrypted in one pass (in parallel when a crypto executor
+    is configured) and the publisher nonce is incremented only once.
+
+    ---
+    tags:
+      - services
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        description: Asset urls encryption, for several documents.
+        schema:
+          type: object
+          required:
+            - documents
+            - publisherAddress:
+          properties:
+            documents:
+              description: List of {documentId, document} objects.
+              type: array
+              example: [{'documentId': 'did:op:08a4...', 'document': '/some-url'}]
+            publisherAddress:
+              description: Publisher address.
+              type: string
+              example: '0x00a329c0648769A73afAc7F9381E08FB43dBEA72'
+    responses:
+      201:
+        description: documents successfully encrypted.
+      400:
+        description: One of the documents is invalid or the batch is too large.
+      500:
+        description: Error
+
+    return: the list of {documentId, encryptedDocument}, in request order
+    """
+    data = get_request_data(request)
+    items = data.get("documents")
+    publisher_address = data.get("publisherAddress")
+
+    max_batch_size = get_config().encrypt_max_batch_size
+    if len(items) > max_batch_size:
+        return jsonify(error=f"At most {max_batch_size} documents per batch."), 400
+
+    dids = []
+    documents = []
+    for i, item in enumerate(items):
+        if not (
+            isinstance(item, dict) and item.get("documentId") and item.get("document")
+        ):
+            return (
+                jsonify(error=f"documentId and document are required at index {i}."),
+                400,
+            )
+
+        document = item["document"]
+        if isinstance(document, str):
+            try:
+                document = json.loads(document)
+            except ValueError:
+                return jsonify(error=f"Invalid json document at index {i}."), 400
+
+        dids.append(item["documentId"])
+        documents.append(json.dumps(document, separators=(",", ":")))
+
+    try:
+        encrypted_documents = do_encrypt_many(documents, provider_wallet)
+        logger.info(
+            f"encrypted {len(encrypted_documents)} documents, "
+            f"publisher {publisher_address}"
+        )
+        increment_nonce(publisher_address)
+        return Response(
+            json.dumps(
+                {
+                    "encryptedDocuments": [
+                        {"documentId": did, "encryptedDocument": encrypted_document}
+                        for did, encrypted_document in zip(dids, encrypted_documents)
+                    ]
+                }
+            ),
+            201,
+            headers={"content-type": "application/json"},
+        )
+
+    except Exception as e:
+        logger.error(
+            f"Error: {e}. \n"
+            f"providerAddress={provider_wallet.address}\n"
+            f"Payload was: {len(items)} documents, "
+            f"publisherAddress={publisher_address}",
+            exc_info=1,
+        )
+        return jsonify(error=str(e)), 500
+
+
+@services.route("/checksum", methods=["GET"])
+@validate(ChecksumJobRequest)
+def checksum():
+    """Returns the progress of a checksum job started by fileinfo.
+
+    ---
+    tags:
+      - services
+
+    responses:
+      200:
+        description: the status of the job.
+      404:
+        description: the job does not exist or expired.
+
+    return: jobId, status, bytesHashed, totalBytes, throughput, checksums,
+      error
+    """
+    data = get_request_data(request)
+    job = get_checksum_job(data.get("jobId"))
+    if not job:
+        return jsonify(error="Checksum job not found."), 404
+
+    return Response(json.dumps(job), 200, headers={"content-type": "application/json"})
+
+
 @services.route("/fileinfo", methods=["POST"])
 @validate(FileInfoRequest)
 def fileinfo():
@@ -211,6 +358,8 @@ def fileinfo():
         description: the URL(s) could be analysed (returns the result).
       400:
         description: the URL(s) could not be analysed (bad request).
+      503:
+        description: too many checksum jobs are pending.
 
     return: list of file info (index, valid, contentLength, contentType)
     """
@@ -227,12 +376,34 @@ def fileinfo():
         url_list = [get_download_url(url, app.config["CONFIG_FILE"])]
 
     with_checksum = data.get("checksum", False)
+    # large files are hashed in the background, the client polls /checksum
+    checksum_job = data.get("checksumJob", False)
+    checksum_types = data.get("checksumTypes") or ["sha256"]
+    if isinstance(checksum_types, str):
+        checksum_types = checksum_types.split(",")
+    unsupported = set(checksum_types) - set(SUPPORTED_CHECKSUM_TYPES)
+    if unsupported:
+        return (
+            jsonify(
+                error=f"Unsupported checksum types: {', '.join(sorted(unsupported))}."
+            ),
+            400,
+        )
 
     files_info = []
-    for i, url in enumerate(url_list):
-        valid, details = check_url_details(url, with_checksum=with_checksum)
+    results = check_urls_details(
+        url_list,
+        with_checksum=with_checksum and not checksum_job,
+        checksum_types=checksum_types,
+    )
+    for i, (valid, details) in enumerate(results):
         info = {"index": i, "valid": valid}
         info.update(details)
+        if valid and checksum_job:
+            try:
+                info["checksumJobId"] = start_checksum_job(url_list[i], checksum_types)
+            except ChecksumJobQueueFullError as e:
+                return jsonify(error=str(e)), 503
         files_info.append(info)
 
     return Response(
@@ -340,6 +511,16 @@ def download():
       - name: index
         in: query
         description: Index of the file in the array of files.
+      - name: archive
+        in: query
+        description: zip or tar, to download several files in one archive
+                     instead of the file at index.
+        type: string
+      - name: fileIndices
+        in: query
+        description: Comma separated indices of the files in the archive,
+                     all files by default.
+        type: string
     responses:
       200:
         description: Redirect to valid asset url.
@@ -365,6 +546,32 @@ def download():
         if did.startswith("did:"):
             did = add_0x_prefix(did_to_id(did))
 
+        archive_format = data.get("archive")
+        if archive_format:
+            urls = get_asset_urls(asset, provider_wallet)
+            if not urls:
+                return jsonify(error="Cannot decrypt files for this asset."), 400
+
+            file_indices = data.get("fileIndices")
+            if file_indices is None:
+                file_indices = range(len(urls))
+            elif isinstance(file_indices, str):
+                file_indices = file_indices.split(",")
+            try:
+                file_indices = [int(file_index) for file_index in file_indices]
+            except (TypeError, ValueError):
+                file_indices = []
+            if not file_indices or not all(
+                0 <= file_index < len(urls) for file_index in file_indices
+            ):
+                return (
+                    jsonify(
+                        error=f"fileIndices must be indices of the {len(urls)} "
+                        "files of the asset."
+                    ),
+                    400,
+                )
+
         _tx, _order_log, _transfer_log = validate_order(
             consumer_address,
             token_address,
@@ -382,6 +589,21 @@ def download():
 
         assert service_type == ServiceTypes.ASSET_ACCESS
 
+        if archive_format:
+            files = []
+            for file_index in file_indices:
+                url = urls[file_index]
+                files.append((url, get_download_url(url, app.config["CONFIG_FILE"])))
+
+            logger.info(
+                f"Done processing consume request for asset {did}, "
+                f"{len(files)} files in a {archive_format} archive"
+            )
+            increment_nonce(consumer_address)
+            return build_archive_response(
+                requests_session, files, archive_format, f"{did}.{archive_format}"
+            )
+
         file_index = int(data.get("fileIndex"))
         file_attributes = asset.metadata["main"]["files"][file_index]
         content_type = file_attributes.get("contentType", None)
@@ -8,14 +8,13 @@ import configparser
 from flask import jsonify
 from flask_swagger import swagger
 from flask_swagger_ui import get_swaggerui_blueprint
-from ocean_provider.config import Config
 from ocean_provider.constants import BaseURLs, ConfigSections, Metadata
 from ocean_provider.myapp import app
 from ocean_provider.routes import services
 from ocean_provider.util import get_compute_address
-from ocean_provider.utils.basics import get_provider_wallet
+from ocean_provider.utils.basics import get_config, get_provider_wallet
 
-config = Config(filename=app.config["CONFIG_FILE"])
+config = get_config(app.config["CONFIG_FILE"])
 provider_url = config.get(ConfigSections.RESOURCES, "ocean_provider.url")
 # not included URLs
 blocked_url = ["services.simple_flow_consume"]
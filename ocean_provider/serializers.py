@@ -4,8 +4,9 @@
 #
 import json
 
-from ocean_provider.util import get_asset_url_at_index
-from ocean_provider.utils.basics import get_asset_from_metadatastore, get_config
+from ocean_provider.asset_context import AssetContext
+from ocean_provider.myapp import app
+from ocean_provider.utils.basics import get_config
 from ocean_utils.agreements.service_agreement import ServiceAgreement
 from ocean_utils.agreements.service_types import ServiceTypes
 
@@ -15,11 +16,16 @@ def get_metadata_url():
 
 
 class StageAlgoSerializer:
-    def __init__(self, consumer_address, provider_wallet, algo_data):
+    def __init__(
+        self, consumer_address, provider_wallet, algo_data, asset_context=None
+    ):
         """Initialize Serializer."""
         self.consumer_address = consumer_address
         self.provider_wallet = provider_wallet
         self.algo_data = algo_data
+        self.asset_context = asset_context or AssetContext(
+            provider_wallet, app.config["CONFIG_FILE"]
+        )
 
     def serialize(self):
         algorithm_meta = self.algo_data.get("algorithmMeta")
@@ -41,13 +47,13 @@ class StageAlgoSerializer:
                 }
             )
 
-        algo_asset = get_asset_from_metadatastore(get_metadata_url(), algorithm_did)
+        algo_asset = self.asset_context.get_asset(algorithm_did)
         service = ServiceAgreement.from_ddo(ServiceTypes.ASSET_ACCESS, algo_asset)
 
         dict_template["id"] = algorithm_did
         dict_template["rawcode"] = ""
 
-        asset_urls = get_asset_url_at_index(0, algo_asset, self.provider_wallet)
+        asset_urls = self.asset_context.get_asset_url_at_index(0, algo_asset)
         if asset_urls:
             dict_template["url"] = asset_urls
         else:
@@ -0,0 +1,75 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import hashlib
+import logging
+
+from ocean_provider import models
+from ocean_provider.database import SessionLocal
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+
+def get_validators(headers):
+    """Returns the (etag, last_modified, content_length) of a response.
+
+    Returns None if the response has neither an ETag nor a Last-Modified
+    header, since a change of the file could then not be detected.
+    """
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if not (etag or last_modified):
+        return None
+
+    return etag, last_modified, headers.get("Content-Length")
+
+
+def get_url_checksum(url, checksum_type, validators):
+    """Returns the stored checksum of `url` if its validators did not change."""
+    session = SessionLocal()
+    try:
+        result = (
+            session.query(models.UrlChecksum)
+            .filter_by(url_hash=_hash_url(url), checksum_type=checksum_type)
+            .first()
+        )
+        if result and (
+            result.etag,
+            result.last_modified,
+            result.content_length,
+        ) == tuple(validators):
+            return result.checksum
+    except SQLAlchemyError as e:
+        logger.error(f"Error reading the stored checksum: {e}")
+    finally:
+        session.close()
+
+    return None
+
+
+def store_url_checksum(url, checksum_type, validators, checksum):
+    etag, last_modified, content_length = validators
+    session = SessionLocal()
+    try:
+        session.merge(
+            models.UrlChecksum(
+                url_hash=_hash_url(url),
+                checksum_type=checksum_type,
+                etag=etag,
+                last_modified=last_modified,
+                content_length=content_length,
+                checksum=checksum,
+            )
+        )
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error storing the checksum: {e}")
+    finally:
+        session.close()
+
+
+def _hash_url(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
@@ -2,11 +2,18 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+import hashlib
 import json
 import logging
 import mimetypes
 import os
+import threading
+import time
 from cgi import parse_header
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
 
 import requests
 from flask import Response
@@ -16,19 +23,58 @@ from ocean_lib.web3_internal.utils import add_ethereum_prefix_and_hash_msg
 from ocean_lib.web3_internal.web3_provider import Web3Provider
 from ocean_lib.web3_internal.web3helper import Web3Helper
 from ocean_provider.constants import BaseURLs
+from ocean_provider.download_archive import (
+    ARCHIVE_CONTENT_TYPES,
+    iter_tar_chunks,
+    iter_zip_chunks,
+)
+from ocean_provider.download_cache import get_download_cache
+from ocean_provider.exceptions import DownloadAbortedError
+from ocean_provider.url_checksum import get_validators
 from ocean_provider.util_url import is_safe_url
 from ocean_provider.utils.basics import (
     get_asset_from_metadatastore,
     get_config,
     get_provider_wallet,
 )
-from ocean_provider.utils.encryption import do_decrypt
+from ocean_provider.utils.cache import TTLCache
+from ocean_provider.utils.encryption import do_decrypt, do_decrypt_many
 from ocean_utils.agreements.service_agreement import ServiceAgreement
 from osmosis_driver_interface.osmosis import Osmosis
 from websockets import ConnectionClosed
+from werkzeug.wsgi import wrap_file
 
 logger = logging.getLogger(__name__)
 
+DECRYPTED_FILES_CACHE_TTL = 24 * 60 * 60
+# unsigned urls generated by Osmosis never expire, refresh them hourly anyway
+UNSIGNED_URL_CACHE_TTL = 60 * 60
+# signed urls are dropped from the cache this many seconds before they expire
+SIGNED_URL_EXPIRY_MARGIN = 60
+# download chunks grow while a chunk is read faster than this (seconds) and
+# shrink, down to MIN_DOWNLOAD_CHUNK_SIZE, when one takes 4 times as long
+DOWNLOAD_CHUNK_TARGET_TIME = 0.05
+MIN_DOWNLOAD_CHUNK_SIZE = 8 * 1024
+# seconds over which the speed of a download is compared to download.min_speed
+DOWNLOAD_STALL_WINDOW = 10
+# headers of the client request forwarded to the storage of a file
+CONDITIONAL_REQUEST_HEADERS = ("If-None-Match", "If-Modified-Since", "If-Range")
+# headers of the storage response returned to the client, 304 responses are
+# passed through as well
+PROPAGATED_RESPONSE_HEADERS = (
+    "ETag",
+    "Last-Modified",
+    "Accept-Ranges",
+    "Content-Range",
+)
+
+_decrypted_files_cache = None
+_decrypted_files_owner = None
+_osmosis_plugins = {}
+_download_url_cache = None
+_segment_executor = None
+_segment_executor_lock = threading.Lock()
+
 
 def get_metadata_url():
     return get_config().aquarius_url
@@ -52,47 +98,114 @@ def build_download_response(
 
         if is_range_request:
             download_request_headers = {"Range": request.headers.get("range")}
-            download_response_headers = download_request_headers
+            download_response_headers = dict(download_request_headers)
+
+        for header in CONDITIONAL_REQUEST_HEADERS:
+            value = request.headers.get(header)
+            if value is not None:
+                download_request_headers[header] = value
+        is_conditional_request = bool(
+            download_request_headers.keys() & {"If-None-Match", "If-Modified-Since"}
+        )
+
+        config = get_config()
+        cache = None
+        if download_url.startswith(("http://", "https://")):
+            cache = get_download_cache()
+        cached = cache.get(url) if cache else None
+        if cached and not is_conditional_request:
+            etag, last_modified, _ = cached["validators"]
+            if etag:
+                download_request_headers["If-None-Match"] = etag
+            if last_modified:
+                download_request_headers["If-Modified-Since"] = last_modified
 
         response = requests_session.get(
-            download_url, headers=download_request_headers, stream=True, timeout=3
+            download_url,
+            headers=download_request_headers,
+            stream=True,
+            timeout=config.get_download_timeouts(download_url),
         )
 
-        if not is_range_request:
-            filename = url.split("/")[-1]
-
-            content_disposition_header = response.headers.get("content-disposition")
-            if content_disposition_header:
-                _, content_disposition_params = parse_header(content_disposition_header)
-                content_filename = content_disposition_params.get("filename")
-                if content_filename:
-                    filename = content_filename
-
-            content_type_header = response.headers.get("content-type")
-            if content_type_header:
-                content_type = content_type_header
-
-            file_ext = os.path.splitext(filename)[1]
-            if file_ext and not content_type:
-                content_type = mimetypes.guess_type(filename)[0]
-            elif not file_ext and content_type:
-                # add an extension to filename based on the content_type
-                extension = mimetypes.guess_extension(content_type)
-                if extension:
-                    filename = filename + extension
+        if cached:
+            if (response.status_code == 304 and not is_conditional_request) or (
+                response.status_code == 200
+                and get_validators(response.headers) == cached["validators"]
+            ):
+                # unchanged upstream, the body is served from the cache
+                response.close()
+                response = cache.open(cached, download_request_headers.get("Range"))
+            elif response.status_code != 304:
+                cache.remove(url)
 
+        if not is_range_request:
+            filename, content_type = get_download_filename(url, response, content_type)
             download_response_headers = {
                 "Content-Disposition": f"attachment;filename={filename}",
                 "Access-Control-Expose-Headers": "Content-Disposition",
             }
 
-        def _generate(_response):
-            for chunk in _response.iter_content(chunk_size=4096):
-                if chunk:
-                    yield chunk
+        for header in PROPAGATED_RESPONSE_HEADERS:
+            value = response.headers.get(header)
+            if value:
+                download_response_headers[header] = value
+        content_length = response.headers.get("Content-Length")
+        if content_length and not response.headers.get("Content-Encoding"):
+            # encoded bodies are decoded by the proxy, their length differs
+            download_response_headers["Content-Length"] = content_length
+
+        local_file = getattr(response, "local_file", None)
+        if local_file is not None:
+            # files on disk go to the server's file wrapper, which can use
+            # sendfile
+            if is_range_request and "Content-Type" in response.headers:
+                # multipart/byteranges with the boundary of the parts
+                content_type = response.headers["Content-Type"]
+
+            return Response(
+                wrap_file(
+                    request.environ,
+                    local_file.detach(),
+                    config.download_max_chunk_size,
+                ),
+                response.status_code,
+                headers=download_response_headers,
+                content_type=content_type,
+                direct_passthrough=True,
+            )
+
+        if (
+            config.download_segments > 1
+            and response.status_code == 200
+            and response.headers.get("Accept-Ranges") == "bytes"
+            and not response.headers.get("Content-Encoding")
+            and (content_length or "").isdigit()
+            and int(content_length) >= config.download_segment_threshold
+            and has_strong_validator(response.headers)
+        ):
+            chunks = iter_segmented_chunks(
+                requests_session,
+                download_url,
+                response,
+                config.download_segments,
+                config.download_segment_size,
+                timeout=config.get_download_timeouts(download_url),
+                max_duration=config.download_max_duration,
+                min_speed=config.download_min_speed,
+            )
+        else:
+            chunks = iter_response_chunks(
+                response,
+                config.download_chunk_size,
+                config.download_max_chunk_size,
+                max_duration=config.download_max_duration,
+                min_speed=config.download_min_speed,
+            )
+        if cache and not is_range_request and cache.is_cacheable(response):
+            chunks = cache.store(url, response, chunks)
 
         return Response(
-            _generate(response),
+            chunks,
             response.status_code,
             headers=download_response_headers,
             content_type=content_type,
@@ -102,14 +215,360 @@ def build_download_response(
         raise
 
 
+def get_download_filename(url, response, content_type=None):
+    """
+    Returns the filename and content type of the file downloaded from `url`,
+    taken from the headers of its `response` when they have them.
+    """
+    filename = url.split("/")[-1]
+
+    content_disposition_header = response.headers.get("content-disposition")
+    if content_disposition_header:
+        _, content_disposition_params = parse_header(content_disposition_header)
+        content_filename = content_disposition_params.get("filename")
+        if content_filename:
+            filename = content_filename
+
+    content_type_header = response.headers.get("content-type")
+    if content_type_header:
+        content_type = content_type_header
+
+    file_ext = os.path.splitext(filename)[1]
+    if file_ext and not content_type:
+        content_type = mimetypes.guess_type(filename)[0]
+    elif not file_ext and content_type:
+        # add an extension to filename based on the content_type
+        extension = mimetypes.guess_extension(content_type)
+        if extension:
+            filename = filename + extension
+
+    return filename, content_type
+
+
+def build_archive_response(requests_session, files, archive_format, filename):
+    """
+    Returns a response streaming `files`, a list of (url, download_url)
+    pairs, as a zip or tar archive named `filename`. The files are downloaded
+    one after the other while the archive is sent, a file that can not be
+    downloaded aborts the transfer.
+    """
+    try:
+        for url, _ in files:
+            if not is_safe_url(url):
+                raise ValueError(f"Unsafe url {url}")
+
+        archive_files = _iter_archive_files(requests_session, files)
+        if archive_format == "zip":
+            chunks = iter_zip_chunks(archive_files)
+        else:
+            chunks = iter_tar_chunks(archive_files)
+
+        return Response(
+            chunks,
+            200,
+            headers={
+                "Content-Disposition": f"attachment;filename={filename}",
+                "Access-Control-Expose-Headers": "Content-Disposition",
+            },
+            content_type=ARCHIVE_CONTENT_TYPES[archive_format],
+        )
+    except Exception as e:
+        logger.error(f"Error preparing archive download response: {str(e)}")
+        raise
+
+
+def _iter_archive_files(requests_session, files):
+    """
+    Yields the name in the archive, size (None when unknown) and chunks of
+    each of `files`, downloading them one at a time.
+    """
+    config = get_config()
+    names = set()
+    for index, (url, download_url) in enumerate(files):
+        response = requests_session.get(
+            download_url,
+            stream=True,
+            timeout=config.get_download_timeouts(download_url),
+        )
+        try:
+            if response.status_code != 200:
+                raise DownloadAbortedError(
+                    f"Download of file {index} failed with status "
+                    f"{response.status_code}."
+                )
+
+            filename, _ = get_download_filename(url, response)
+            name = os.path.basename(filename.split("?")[0].replace("\\", "/"))
+            if name in ("", ".", ".."):
+                name = f"file{index}"
+            if name in names:
+                name = f"{index}_{name}"
+            names.add(name)
+
+            size = response.headers.get("Content-Length")
+            if (size or "").isdigit() and not response.headers.get("Content-Encoding"):
+                size = int(size)
+            else:
+                # encoded bodies are decoded by the proxy, their length differs
+                size = None
+
+            yield name, size, iter_response_chunks(
+                response,
+                config.download_chunk_size,
+                config.download_max_chunk_size,
+                max_duration=config.download_max_duration,
+                min_speed=config.download_min_speed,
+            )
+        finally:
+            response.close()
+
+
+def iter_response_chunks(
+    response, chunk_size, max_chunk_size, max_duration=None, min_speed=None
+):
+    """
+    Yields the body of the streamed `response`, starting with chunks of
+    `chunk_size` bytes. The size doubles, up to `max_chunk_size`, while
+    chunks are read in less than DOWNLOAD_CHUNK_TARGET_TIME, so fast sources
+    are proxied with few large writes, and halves when the source is slow,
+    so slow sources still stream without long pauses.
+
+    The response is closed and DownloadAbortedError raised when the transfer
+    lasts more than `max_duration` seconds or its speed over a
+    DOWNLOAD_STALL_WINDOW falls below `min_speed` bytes per second. Limits
+    are checked between chunks, so with `min_speed` the chunks are kept small
+    enough to be read within the window at that speed.
+    """
+    raw = response.raw
+    if hasattr(raw, "stream"):
+        # urllib3 response, decoders can consume a read without output
+        # before the end of the body, which closes the response
+        def read(size):
+            chunk = raw.read(size, decode_content=True)
+            while not chunk and not raw.closed:
+                chunk = raw.read(size, decode_content=True)
+            return chunk
+
+    else:
+        read = raw.read
+
+    max_chunk_size = max(chunk_size, max_chunk_size)
+    if min_speed:
+        max_chunk_size = max(
+            min(max_chunk_size, int(min_speed * DOWNLOAD_STALL_WINDOW)),
+            MIN_DOWNLOAD_CHUNK_SIZE,
+        )
+        chunk_size = min(chunk_size, max_chunk_size)
+
+    started = window_start = time.monotonic()
+    window_bytes = 0
+    while True:
+        start = time.monotonic()
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+
+        now = time.monotonic()
+        elapsed = now - start
+        if elapsed < DOWNLOAD_CHUNK_TARGET_TIME:
+            chunk_size = min(chunk_size * 2, max_chunk_size)
+        elif elapsed > 4 * DOWNLOAD_CHUNK_TARGET_TIME:
+            chunk_size = max(chunk_size // 2, MIN_DOWNLOAD_CHUNK_SIZE)
+
+        if max_duration and now - started > max_duration:
+            response.close()
+            raise DownloadAbortedError(
+                f"Download did not complete within {max_duration} seconds."
+            )
+
+        window_bytes += len(chunk)
+        if now - window_start >= DOWNLOAD_STALL_WINDOW:
+            speed = window_bytes / (now - window_start)
+            if min_speed and speed < min_speed:
+                response.close()
+                raise DownloadAbortedError(
+                    f"Download stalled at {int(speed)} bytes per second."
+                )
+            window_start, window_bytes = now, 0
+
+        yield chunk
+
+
+def iter_segmented_chunks(
+    requests_session,
+    download_url,
+    response,
+    segments,
+    segment_size,
+    timeout=None,
+    max_duration=None,
+    min_speed=None,
+):
+    """
+    Yields the body of the full `response` to `download_url` as segments of
+    `segment_size` bytes, fetched with up to `segments` concurrent range
+    requests on the shared pool of `download.segment_workers` threads, so
+    the segment requests of all downloads of a process are bounded.
+    Segments are yielded in order, at most `segments` + 1 of them
+    are held in memory. The first one is streamed from `response`, the others
+    are asked for with If-Range so they all come from the same version of the
+    file, and DownloadAbortedError is raised if it changes.
+
+    Each segment is read with the `min_speed` check of iter_response_chunks,
+    at the share of the speed of one of the `segments` connections.
+    """
+    content_length = int(response.headers["Content-Length"])
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    segment_min_speed = min_speed / segments if min_speed else None
+
+    def _read(segment_response):
+        return iter_response_chunks(
+            segment_response,
+            MIN_DOWNLOAD_CHUNK_SIZE,
+            segment_size,
+            min_speed=segment_min_speed,
+        )
+
+    def _fetch(start, stop):
+        headers = {"Range": f"bytes={start}-{stop - 1}", "Accept-Encoding": "identity"}
+        if validator:
+            headers["If-Range"] = validator
+        with requests_session.get(
+            download_url, headers=headers, stream=True, timeout=timeout
+        ) as segment:
+            content = b""
+            if segment.status_code == 206:
+                content = b"".join(_read(segment))
+        if len(content) != stop - start:
+            raise DownloadAbortedError(
+                f"Incomplete segment {start}-{stop - 1}, the file may have changed."
+            )
+        return content
+
+    started = time.monotonic()
+    first_stop = min(segment_size, content_length)
+    pending = deque(
+        (start, min(start + segment_size, content_length))
+        for start in range(first_stop, content_length, segment_size)
+    )
+    executor = _get_segment_executor()
+    futures = deque()
+    try:
+        while pending and len(futures) < segments:
+            futures.append(executor.submit(_fetch, *pending.popleft()))
+
+        first_length = 0
+        for chunk in _read(response):
+            chunk = chunk[: first_stop - first_length]
+            first_length += len(chunk)
+            yield chunk
+            if first_length == first_stop:
+                break
+        response.close()
+        if first_length != first_stop:
+            raise DownloadAbortedError("The file changed while it was downloaded.")
+
+        while futures:
+            content = futures.popleft().result()
+            if pending:
+                futures.append(executor.submit(_fetch, *pending.popleft()))
+            if max_duration and time.monotonic() - started > max_duration:
+                raise DownloadAbortedError(
+                    f"Download did not complete within {max_duration} seconds."
+                )
+            yield content
+    finally:
+        response.close()
+        for future in futures:
+            future.cancel()
+
+
+def _get_segment_executor():
+    global _segment_executor
+    with _segment_executor_lock:
+        if _segment_executor is None:
+            _segment_executor = ThreadPoolExecutor(
+                max_workers=get_config().download_segment_workers,
+                thread_name_prefix="segment",
+            )
+
+    return _segment_executor
+
+
+def has_strong_validator(headers):
+    """
+    Returns True if `headers` have a validator If-Range can use, a strong
+    ETag or, without ETag, a Last-Modified date.
+    """
+    etag = headers.get("ETag")
+    if etag:
+        return not etag.startswith("W/")
+
+    return bool(headers.get("Last-Modified"))
+
+
+def get_decrypted_files_cache(wallet):
+    """Returns the in-memory cache of decrypted files lists for `wallet`.
+
+    Entries are keyed by a digest of the encrypted payload and are never
+    persisted. The cache is cleared whenever the provider key changes.
+    """
+    global _decrypted_files_cache, _decrypted_files_owner
+    if _decrypted_files_cache is None:
+        _decrypted_files_cache = TTLCache(
+            get_config().decrypted_files_cache_max_entries, DECRYPTED_FILES_CACHE_TTL
+        )
+
+    if wallet.address != _decrypted_files_owner:
+        _decrypted_files_cache.clear()
+        _decrypted_files_owner = wallet.address
+
+    return _decrypted_files_cache
+
+
+def _get_encrypted_files(asset):
+    encrypted_files = asset.encrypted_files
+    if encrypted_files.startswith("{"):
+        encrypted_files = json.loads(encrypted_files)["encryptedDocument"]
+
+    return encrypted_files, hashlib.sha256(encrypted_files.encode("utf-8")).hexdigest()
+
+
+def decrypt_assets_files(assets, wallet):
+    """Decrypts the files of several assets in one batch to warm the cache.
+
+    The decryptions run on the crypto executor when one is configured.
+    Assets whose files cannot be read are skipped, `get_asset_files_list`
+    reports their errors when they are actually used.
+    """
+    cache = get_decrypted_files_cache(wallet)
+    pending = {}
+    for asset in assets:
+        try:
+            encrypted_files, cache_key = _get_encrypted_files(asset)
+        except Exception:
+            continue
+
+        if cache.get(cache_key) is None:
+            pending[cache_key] = encrypted_files
+
+    decrypted = do_decrypt_many(list(pending.values()), wallet)
+    for cache_key, files_str in zip(pending.keys(), decrypted):
+        if files_str:
+            cache.set(cache_key, files_str)
+
+
 def get_asset_files_list(asset, wallet):
     try:
-        encrypted_files = asset.encrypted_files
-        if encrypted_files.startswith("{"):
-            encrypted_files = json.loads(encrypted_files)["encryptedDocument"]
-        files_str = do_decrypt(encrypted_files, wallet)
-        if not files_str:
-            return None
+        encrypted_files, cache_key = _get_encrypted_files(asset)
+        cache = get_decrypted_files_cache(wallet)
+        files_str = cache.get(cache_key)
+        if files_str is None:
+            files_str = do_decrypt(encrypted_files, wallet)
+            if not files_str:
+                return None
+            cache.set(cache_key, files_str)
+
         logger.debug(f"Got decrypted files str {files_str}")
         files_list = json.loads(files_str)
         if not isinstance(files_list, list):
@@ -175,16 +634,84 @@ def get_asset_download_urls(asset, wallet, config_file):
 
 
 def get_download_url(url, config_file):
+    """Returns the url to download `url` from, as generated by Osmosis.
+
+    Osmosis plugins are instantiated once per storage host and config file.
+    Generated urls are cached until shortly before their own expiry, urls
+    with a signature whose expiry can not be determined are not cached.
+    """
+    cache = get_download_url_cache()
+    cache_key = (url, config_file)
+    download_url = cache.get(cache_key)
+    if download_url:
+        return download_url
+
     try:
         logger.info("Connecting through Osmosis to generate the signed url.")
-        osm = Osmosis(url, config_file)
-        download_url = osm.data_plugin.generate_url(url)
+        download_url = _get_osmosis_plugin(url, config_file).generate_url(url)
         logger.debug(f"Osmosis generated the url: {download_url}")
-        return download_url
     except Exception as e:
         logger.error(f"Error generating url (using Osmosis): {str(e)}")
         raise
 
+    if download_url == url:
+        cache.set(cache_key, download_url, ttl=UNSIGNED_URL_CACHE_TTL)
+    else:
+        expires_at = get_signed_url_expiry(download_url)
+        if expires_at:
+            ttl = expires_at - time.time() - SIGNED_URL_EXPIRY_MARGIN
+            cache.set(cache_key, download_url, ttl=ttl)
+
+    return download_url
+
+
+def get_download_url_cache():
+    global _download_url_cache
+    if _download_url_cache is None:
+        _download_url_cache = TTLCache(
+            get_config().signed_url_cache_max_entries, UNSIGNED_URL_CACHE_TTL
+        )
+
+    return _download_url_cache
+
+
+def _get_osmosis_plugin(url, config_file):
+    parsed_url = urlparse(url)
+    key = (parsed_url.scheme, parsed_url.netloc, config_file)
+    plugin = _osmosis_plugins.get(key)
+    if plugin is None:
+        plugin = _osmosis_plugins.setdefault(key, Osmosis(url, config_file).data_plugin)
+
+    return plugin
+
+
+def get_signed_url_expiry(signed_url):
+    """Returns the expiry of a signed url as a unix timestamp, None if unknown.
+
+    Understands Azure SAS tokens (`se`), AWS signature v4
+    (`X-Amz-Date` + `X-Amz-Expires`) and `Expires` epoch parameters.
+    """
+    params = parse_qs(urlparse(signed_url).query)
+    try:
+        if "se" in params:
+            expiry = datetime.fromisoformat(params["se"][0].replace("Z", "+00:00"))
+            if expiry.tzinfo is None:
+                expiry = expiry.replace(tzinfo=timezone.utc)
+            return expiry.timestamp()
+
+        if "X-Amz-Date" in params and "X-Amz-Expires" in params:
+            signed_at = datetime.strptime(
+                params["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ"
+            ).replace(tzinfo=timezone.utc)
+            return signed_at.timestamp() + int(params["X-Amz-Expires"][0])
+
+        if "Expires" in params:
+            return float(params["Expires"][0])
+    except ValueError:
+        return None
+
+    return None
+
 
 def get_compute_endpoint():
     return get_config().operator_service_url + "/api/v1/operator/compute"
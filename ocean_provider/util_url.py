@@ -5,17 +5,48 @@
 import hashlib as hash
 import ipaddress
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urlparse
 
 import dns.resolver
 import requests
 from ocean_lib.data_provider.data_service_provider import DataServiceProvider
+from ocean_provider.exceptions import DownloadAbortedError
+from ocean_provider.url_checksum import (
+    get_url_checksum,
+    get_validators,
+    store_url_checksum,
+)
 from ocean_provider.utils.basics import get_config, get_provider_wallet
+from ocean_provider.utils.cache import TTLCache
+from requests.utils import select_proxy
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.poolmanager import PoolKey
 
 logger = logging.getLogger(__name__)
 
-REQUEST_TIMEOUT = 3
 CHUNK_SIZE = 8192
+# hashlib releases the GIL while hashing buffers larger than 2 KiB, large
+# chunks keep the time spent in the interpreter low for every algorithm
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# smaller chunks when the checksum has a deadline, so it is checked often
+CHECKSUM_DEADLINE_CHUNK_SIZE = 64 * 1024
+SUPPORTED_CHECKSUM_TYPES = ("sha256", "sha512", "sha1", "md5", "blake2b")
+
+_dns_resolver = None
+_dns_negative_cache = None
+_safe_domain_cache = None
+_dns_executor = None
+_url_session = None
+_dns_lock = threading.Lock()
+# urllib3 < 1.24.2 can not key https pools by hostname, so TLS connections
+# are only pinned to the validated address on newer versions
+_CAN_PIN_HTTPS = "key_server_hostname" in PoolKey._fields
+_url_session_lock = threading.Lock()
+_fileinfo_executor = None
+_fileinfo_lock = threading.Lock()
 
 
 def is_safe_url(url):
@@ -23,8 +54,10 @@ def is_safe_url(url):
         return False
 
     result = urlparse(url)
+    if not result.hostname:
+        return False
 
-    return is_safe_domain(result.netloc)
+    return is_safe_domain(result.hostname)
 
 
 def is_safe_schema(url):
@@ -54,28 +87,106 @@ def is_this_same_provider(url):
         return False
 
 
+def get_dns_resolver():
+    """Returns the shared resolver, its cache expires answers by their TTL.
+
+    /etc/resolv.conf is only read when the resolver is first created.
+    """
+    global _dns_resolver, _dns_negative_cache, _safe_domain_cache, _dns_executor
+    with _dns_lock:
+        if _dns_resolver is None:
+            config = get_config()
+            resolver = dns.resolver.Resolver()
+            resolver.cache = dns.resolver.LRUCache(config.dns_cache_max_entries)
+            _dns_negative_cache = TTLCache(
+                config.dns_cache_max_entries, config.dns_cache_negative_ttl
+            )
+            _safe_domain_cache = TTLCache(
+                config.dns_cache_max_entries, config.dns_cache_negative_ttl
+            )
+            _dns_executor = ThreadPoolExecutor(thread_name_prefix="dns")
+            _dns_resolver = resolver
+
+    return _dns_resolver
+
+
 def _get_records(domain, record_type):
-    DNS_RESOLVER = dns.resolver.Resolver()
+    resolver = get_dns_resolver()
+    key = (domain, record_type)
+    if _dns_negative_cache.get(key):
+        return None
+
     try:
-        return DNS_RESOLVER.resolve(domain, record_type, search=True)
+        return resolver.resolve(domain, record_type, search=True)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        _dns_negative_cache.set(key, True)
+        logger.info(f"[i] Cannot get {record_type} record for domain {domain}: {e}\n")
     except Exception as e:
         logger.info(f"[i] Cannot get {record_type} record for domain {domain}: {e}\n")
 
-        return None
+    return None
 
 
 def is_safe_domain(domain):
+    """Returns True if all the addresses `domain` resolves to are allowed.
+
+    The A and AAAA records are resolved concurrently. The verdict is cached
+    per domain (and `allow_non_public_ip` setting) for the lowest TTL of the
+    records it was based on.
+    """
+    return _check_domain(domain)[0]
+
+
+def get_safe_addresses(domain):
+    """Returns the validated IP addresses of `domain`, None if it is not safe.
+
+    The list is empty when the domain does not resolve. IPv4 addresses come
+    first. Uses the same cache as `is_safe_domain`.
+    """
+    result, addresses = _check_domain(domain)
+    return addresses if result else None
+
+
+def _check_domain(domain):
+    get_dns_resolver()
+    key = (domain, get_config().allow_non_public_ip)
+    verdict = _safe_domain_cache.get(key)
+    if verdict is not None:
+        return verdict
+
+    ip_v6_future = _dns_executor.submit(_get_records, domain, "AAAA")
     ip_v4_records = _get_records(domain, "A")
-    ip_v6_records = _get_records(domain, "AAAA")
+    ip_v6_records = ip_v6_future.result()
 
     result = validate_dns_records(domain, ip_v4_records, "A") and validate_dns_records(
         domain, ip_v6_records, "AAAA"
     )
 
-    if not is_ip(domain):
-        return result
+    if is_ip(domain):
+        result = result and validate_dns_records(domain, domain, "")
+
+    addresses = [
+        record if isinstance(record, str) else record.to_text().strip()
+        for records in (ip_v4_records, ip_v6_records)
+        if records is not None
+        for record in records
+    ]
+    verdict = (result, addresses)
+    _safe_domain_cache.set(key, verdict, ttl=_get_min_ttl(ip_v4_records, ip_v6_records))
+    return verdict
+
+
+def _get_min_ttl(*answers):
+    """Returns the remaining lifetime of the shortest lived DNS answer, if any."""
+    expirations = [
+        answer.expiration
+        for answer in answers
+        if getattr(answer, "expiration", None) is not None
+    ]
+    if not expirations:
+        return None
 
-    return result and validate_dns_records(domain, domain, "")
+    return min(expirations) - time.time()
 
 
 def validate_dns_records(domain, records, record_type):
@@ -122,22 +233,31 @@ def validate_dns_record(record, domain, record_type):
     return True
 
 
-def check_url_details(url, with_checksum=False):
+def check_url_details(url, with_checksum=False, checksum_types=None, deadline=None):
     """
     If the url argument is invalid, returns False and empty dictionary.
     Otherwise it returns True and a dictionary containing contentType and
     contentLength. If the with_checksum flag is set to True, it also returns
-    the file checksum and the checksumType (currently hardcoded to sha256)
+    the checksums of the file for all the `checksum_types` (sha256 by
+    default), computed in a single pass over the data. The checksum and
+    checksumType keys describe the first of them.
+    The url is reported invalid when it is not checked before `deadline`,
+    a `time.monotonic()` value.
     """
     try:
         if not is_safe_url(url):
             return False, {}
 
-        result, extra_data = _get_result_from_url(url, with_checksum=with_checksum)
+        status_code, headers, extra_data = _get_result_from_url(
+            url,
+            with_checksum=with_checksum,
+            checksum_types=checksum_types,
+            deadline=deadline,
+        )
 
-        if result.status_code == 200:
-            content_type = result.headers.get("Content-Type")
-            content_length = result.headers.get("Content-Length")
+        if status_code == 200:
+            content_type = headers.get("Content-Type")
+            content_length = headers.get("Content-Length")
 
             if content_type or content_length:
                 details = {
@@ -156,30 +276,326 @@ def check_url_details(url, with_checksum=False):
         pass
     except requests.exceptions.ConnectionError:
         pass
+    except (
+        requests.exceptions.HTTPError,
+        requests.exceptions.InvalidURL,
+        requests.exceptions.Timeout,
+        DownloadAbortedError,
+    ):
+        pass
 
     return False, {}
 
 
-def _get_result_from_url(url, with_checksum=False):
-    result = requests.options(url, timeout=REQUEST_TIMEOUT)
+def check_urls_details(urls, with_checksum=False, checksum_types=None):
+    """
+    Runs `check_url_details` for all the urls concurrently, on the shared
+    pool of `fileinfo.concurrency` threads. Returns the (valid, details)
+    results in the order of `urls`. Urls that could not be checked before
+    the `fileinfo.timeout` deadline are reported as invalid, and the checks
+    still running then stop at their next request or chunk.
+    """
+    if not urls:
+        return []
+
+    timeout = get_config().fileinfo_timeout
+    deadline = time.monotonic() + timeout if timeout else None
+    futures = [
+        _get_fileinfo_executor().submit(
+            check_url_details,
+            url,
+            with_checksum=with_checksum,
+            checksum_types=checksum_types,
+            deadline=deadline,
+        )
+        for url in urls
+    ]
+    done, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+
+    if not_done:
+        logger.warning(f"{len(not_done)} url checks did not finish before deadline.")
+
+    return [future.result() if future in done else (False, {}) for future in futures]
+
+
+def _get_fileinfo_executor():
+    global _fileinfo_executor
+    with _fileinfo_lock:
+        if _fileinfo_executor is None:
+            _fileinfo_executor = ThreadPoolExecutor(
+                max_workers=get_config().fileinfo_concurrency,
+                thread_name_prefix="fileinfo",
+            )
+
+    return _fileinfo_executor
+
+
+def get_url_session():
+    """Returns the pooled session used to probe urls, see `SafeAddressAdapter`."""
+    global _url_session
+    with _url_session_lock:
+        if _url_session is None:
+            session = requests.Session()
+            for prefix in ("http://", "https://"):
+                session.mount(
+                    prefix, SafeAddressAdapter(pool_connections=25, pool_maxsize=25)
+                )
+            _url_session = session
+
+    return _url_session
 
-    if (
-        not with_checksum
-        and result.status_code == 200
-        and result.headers.get("Content-Type")
-        and result.headers.get("Content-Length")
-    ):
-        return result, {}
 
+def _get_result_from_url(url, with_checksum=False, checksum_types=None, deadline=None):
+    """
+    Returns the status code and headers describing the file at `url`, and
+    the checksum details when `with_checksum` is set.
+
+    The file is probed with HEAD, then OPTIONS, then a GET of its first byte,
+    stopping as soon as both Content-Type and Content-Length are known.
+    Checksums are stored along with the ETag, Last-Modified and
+    Content-Length of the file, and only recomputed when those change.
+    DownloadAbortedError is raised when `deadline`, a `time.monotonic()`
+    value, passes before the result is known.
+    """
+    session = get_url_session()
+    status_code, headers = _probe_url(session, url, deadline)
     if not with_checksum:
-        # fallback on GET request
-        return requests.get(url, stream=True, timeout=REQUEST_TIMEOUT), {}
+        return status_code, headers, {}
+
+    checksum_types = list(checksum_types or ["sha256"])
+    validators = get_validators(headers) if status_code == 200 else None
+    checksums = {}
+    if validators:
+        for checksum_type in checksum_types:
+            checksum = get_url_checksum(url, checksum_type, validators)
+            if checksum:
+                checksums[checksum_type] = checksum
+
+    missing_types = [t for t in checksum_types if t not in checksums]
+    if missing_types:
+        r, computed, _ = compute_url_checksums(
+            url,
+            missing_types,
+            max_duration=deadline - time.monotonic() if deadline else None,
+        )
+        status_code, headers = r.status_code, r.headers
+        checksums.update(computed)
+
+    return (
+        status_code,
+        headers,
+        {
+            "checksum": checksums[checksum_types[0]],
+            "checksumType": checksum_types[0],
+            "checksums": {t: checksums[t] for t in checksum_types},
+        },
+    )
 
-    sha = hash.sha256()
 
-    with requests.get(url, stream=True) as r:
+def compute_url_checksums(
+    url,
+    checksum_types=("sha256",),
+    chunk_size=CHECKSUM_CHUNK_SIZE,
+    progress_callback=None,
+    max_duration=None,
+):
+    """
+    Downloads the file at `url` once and returns the response, a dict with
+    its checksum for each of the `checksum_types` and the number of bytes
+    hashed. The checksums are stored along with the validators of the
+    response.
+    `progress_callback` is called with the response and the number of bytes
+    hashed so far after each chunk.
+    DownloadAbortedError is raised when the download lasts more than
+    `max_duration` seconds, checked between chunks of at most
+    CHECKSUM_DEADLINE_CHUNK_SIZE bytes.
+    """
+    hashers = {
+        checksum_type: hash.new(checksum_type) for checksum_type in checksum_types
+    }
+    bytes_hashed = 0
+    deadline = None
+    if max_duration is not None:
+        deadline = time.monotonic() + max_duration
+        chunk_size = min(chunk_size, CHECKSUM_DEADLINE_CHUNK_SIZE)
+
+    timeout = _get_timeouts(url, deadline)
+    with get_url_session().get(url, stream=True, timeout=timeout) as r:
         r.raise_for_status()
-        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
-            sha.update(chunk)
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if deadline and time.monotonic() > deadline:
+                raise DownloadAbortedError(
+                    f"Checksum did not complete within {max_duration:.1f} seconds."
+                )
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            bytes_hashed += len(chunk)
+            if progress_callback:
+                progress_callback(r, bytes_hashed)
+
+    checksums = {
+        checksum_type: hasher.hexdigest() for checksum_type, hasher in hashers.items()
+    }
+    validators = get_validators(r.headers)
+    if validators:
+        for checksum_type, checksum in checksums.items():
+            store_url_checksum(url, checksum_type, validators, checksum)
+
+    return r, checksums, bytes_hashed
+
+
+def _get_timeouts(url, deadline=None):
+    """
+    Returns the (connect, read) timeouts of the requests to `url`, capped to
+    the time left before `deadline`, a `time.monotonic()` value.
+    """
+    timeouts = get_config().get_download_timeouts(url)
+    if deadline is None:
+        return timeouts
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DownloadAbortedError("Deadline passed before the request.")
+
+    return tuple(min(timeout, remaining) for timeout in timeouts)
+
+
+def _probe_url(session, url, deadline=None):
+    for method in ("HEAD", "OPTIONS"):
+        timeout = _get_timeouts(url, deadline)
+        result = session.request(method, url, allow_redirects=True, timeout=timeout)
+        if (
+            result.status_code == 200
+            and result.headers.get("Content-Type")
+            and result.headers.get("Content-Length")
+        ):
+            return result.status_code, result.headers
+
+    # fallback on a GET request for the first byte only
+    timeout = _get_timeouts(url, deadline)
+    with session.get(
+        url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout
+    ) as result:
+        headers = result.headers.copy()
+        if result.status_code != 206:
+            return result.status_code, headers
+
+        headers.pop("Content-Length", None)
+        total_length = headers.get("Content-Range", "").rpartition("/")[2]
+        if total_length.isdigit():
+            headers["Content-Length"] = total_length
+
+        return 200, headers
+
+
+class SafeAddressAdapter(requests.adapters.HTTPAdapter):
+    """Transport adapter that connects to the addresses validated for a host.
+
+    The host of each request (including redirects) goes through
+    `get_safe_addresses`, so it is resolved and checked once and the
+    connection is opened to that validated IP address, closing the gap
+    between the check and a second resolution. TLS SNI, certificate
+    verification and the Host header still use the hostname. Connections
+    are pooled per address and hostname. When a connection can not be
+    opened, the next validated address is tried.
+
+    IP address hosts are validated without being resolved, only requests
+    going through a proxy are not checked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parsed_url = urlparse(request.url)
+        if parsed_url.hostname and not is_ip(parsed_url.hostname):
+            # a copy, the original headers are reused when following redirects
+            request = request.copy()
+            request.headers["Host"] = parsed_url.netloc.rpartition("@")[2]
+
+        addresses = self._get_safe_addresses(request.url, kwargs.get("proxies"))
+        if not addresses:
+            return super().send(request, **kwargs)
+
+        try:
+            for address in addresses:
+                self._local.address = address
+                try:
+                    return super().send(request, **kwargs)
+                except requests.exceptions.ConnectionError as e:
+                    reason = getattr(e.args[0] if e.args else None, "reason", None)
+                    if address == addresses[-1] or not isinstance(
+                        reason, ConnectTimeoutError
+                    ):
+                        raise
+                    logger.info(f"Cannot connect to {address} for {request.url}: {e}")
+        finally:
+            self._local.address = None
+
+    def get_connection(self, url, proxies=None):
+        address = getattr(self._local, "address", None)
+        if not address:
+            return super().get_connection(url, proxies)
+
+        parsed_url = urlparse(url)
+        pool_kwargs = {}
+        if parsed_url.scheme == "https":
+            pool_kwargs = {
+                "server_hostname": parsed_url.hostname,
+                "assert_hostname": parsed_url.hostname,
+            }
+
+        return self.poolmanager.connection_from_host(
+            address,
+            port=parsed_url.port,
+            scheme=parsed_url.scheme,
+            pool_kwargs=pool_kwargs,
+        )
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        # requests >= 2.32.2 opens connections here instead of get_connection
+        address = getattr(self._local, "address", None)
+        if not address:
+            return super().get_connection_with_tls_context(
+                request, verify, proxies=proxies, cert=cert
+            )
+
+        host_params, pool_kwargs = self.build_connection_pool_key_attributes(
+            request, verify, cert
+        )
+        if host_params["scheme"] == "https":
+            pool_kwargs.update(
+                server_hostname=host_params["host"],
+                assert_hostname=host_params["host"],
+            )
+
+        return self.poolmanager.connection_from_host(
+            **dict(host_params, host=address), pool_kwargs=pool_kwargs
+        )
 
-    return r, {"checksum": sha.hexdigest(), "checksumType": "sha256"}
+    def _get_safe_addresses(self, url, proxies):
+        """Returns the validated addresses to connect to for `url`, None when
+        the connection is not pinned (ip hosts, proxies, no addresses).
+
+        Raises InvalidURL when the host is not safe.
+        """
+        parsed_url = urlparse(url)
+        host = parsed_url.hostname
+        if not host or select_proxy(url, proxies):
+            return None
+
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            addresses = get_safe_addresses(host)
+        else:
+            addresses = [] if validate_dns_record(host, host, "") else None
+        if addresses is None:
+            raise requests.exceptions.InvalidURL(f"Unsafe url {url}")
+        if parsed_url.scheme == "https" and not _CAN_PIN_HTTPS:
+            return None
+
+        return addresses
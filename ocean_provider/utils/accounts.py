@@ -5,6 +5,7 @@
 import json
 import time
 from datetime import datetime
+from functools import lru_cache
 
 import eth_keys
 from ocean_lib.web3_internal.utils import add_ethereum_prefix_and_hash_msg
@@ -36,7 +37,11 @@ def verify_signature(signer_address, signature, original_msg, nonce: int = None)
 
 
 def get_private_key(wallet):
-    pk = wallet.private_key
+    return _load_private_key(wallet.private_key)
+
+
+@lru_cache(maxsize=4)
+def _load_private_key(pk):
     if not isinstance(pk, bytes):
         pk = web3().toBytes(hexstr=pk)
     return eth_keys.KeyAPI.PrivateKey(pk)
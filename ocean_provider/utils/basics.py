@@ -2,8 +2,14 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+import copy
+import io
+import json
+import logging
 import os
 import site
+import threading
+import uuid
 
 import requests
 from ocean_lib.models.data_token import DataToken
@@ -13,11 +19,16 @@ from ocean_lib.web3_internal.utils import get_wallet
 from ocean_lib.web3_internal.wallet import Wallet
 from ocean_lib.web3_internal.web3_provider import Web3Provider
 from ocean_provider.config import Config
+from ocean_provider.utils.cache import SingleFlight, TTLCache
 from ocean_utils.aquarius.aquarius import Aquarius
+from ocean_utils.ddo.ddo import DDO
 from ocean_utils.http_requests.requests_session import (
     get_requests_session as _get_requests_session,
 )
-from requests_testadapter import Resp
+from urllib3.response import HTTPResponse
+from werkzeug.http import parse_range_header
+
+logger = logging.getLogger(__name__)
 
 
 def get_artifacts_path(config):
@@ -32,9 +43,45 @@ def get_artifacts_path(config):
     return path
 
 
-def get_config():
-    config_file = os.getenv("CONFIG_FILE", "config.ini")
-    return Config(filename=config_file)
+_config_snapshots = {}
+_config_lock = threading.Lock()
+
+
+def get_config(config_file=None):
+    """Returns the process-wide, read-only `Config` loaded from `config_file`.
+
+    The file is parsed once per process and the snapshot is reused until the
+    file's modification time changes or `reload_config()` is called.
+    """
+    config_file = config_file or os.getenv("CONFIG_FILE", "config.ini")
+    mtime = _get_mtime(config_file)
+    snapshot = _config_snapshots.get(config_file)
+    if snapshot and snapshot[0] == mtime:
+        return snapshot[1]
+
+    with _config_lock:
+        snapshot = _config_snapshots.get(config_file)
+        if snapshot and snapshot[0] == mtime:
+            return snapshot[1]
+
+        config = Config(filename=config_file)
+        config.freeze()
+        _config_snapshots[config_file] = (mtime, config)
+
+    return config
+
+
+def reload_config():
+    """Drops the cached config snapshots, e.g. after changing the environment."""
+    with _config_lock:
+        _config_snapshots.clear()
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
 
 def get_env_property(env_variable, property_name):
@@ -75,7 +122,7 @@ def get_datatoken_minter(asset, datatoken_address):
 
 
 def setup_network(config_file=None):
-    config = Config(filename=config_file) if config_file else get_config()
+    config = get_config(config_file)
     network_url = config.network_url
     artifacts_path = get_artifacts_path(config)
 
@@ -103,16 +150,172 @@ def setup_network(config_file=None):
         )
 
 
+# requests with more byte ranges than this get the whole file
+MAX_BYTE_RANGES = 64
+
+
+class FileSlice(io.RawIOBase):
+    """Read only view of the next `length` bytes of an open `file`."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+        self.length = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.file.readinto(memoryview(buffer)[: self.remaining])
+        self.remaining -= count
+        return count
+
+    def fileno(self):
+        # file wrappers using sendfile start at the current file position
+        return self.file.fileno()
+
+    def detach(self):
+        """Returns a new body owning the file, closing this one leaves it open."""
+        body = copy.copy(self)
+        self.file = None
+        self.close()
+        return body
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        super().close()
+
+
+class FileRanges(FileSlice):
+    """multipart/byteranges body with the `ranges` (start, stop) of `file`.
+
+    Only the requested spans are read, seeking to each of them in turn.
+    """
+
+    def __init__(self, file, ranges, size, boundary):
+        parts = []
+        for i, (start, stop) in enumerate(ranges):
+            delimiter = f"--{boundary}" if i == 0 else f"\r\n--{boundary}"
+            content_range = f"Content-Range: bytes {start}-{stop - 1}/{size}"
+            parts.append(f"{delimiter}\r\n{content_range}\r\n\r\n".encode())
+            parts.append((start, stop))
+        parts.append(f"\r\n--{boundary}--\r\n".encode())
+
+        length = sum(
+            len(part) if isinstance(part, bytes) else part[1] - part[0]
+            for part in parts
+        )
+        super().__init__(file, length)
+        self.parts = parts[::-1]
+
+    def readinto(self, buffer):
+        while self.parts:
+            part = self.parts[-1]
+            if isinstance(part, bytes):
+                count = min(len(part), len(buffer))
+                buffer[:count] = part[:count]
+                if count < len(part):
+                    self.parts[-1] = part[count:]
+                else:
+                    self.parts.pop()
+                return count
+
+            start, stop = part
+            self.file.seek(start)
+            count = self.file.readinto(memoryview(buffer)[: stop - start])
+            if not count:
+                # the file was truncated while being read
+                self.parts.clear()
+                return 0
+            if start + count < stop:
+                self.parts[-1] = (start + count, stop)
+            else:
+                self.parts.pop()
+            return count
+
+        return 0
+
+    def fileno(self):
+        raise io.UnsupportedOperation("fileno")
+
+
+def get_byte_ranges(range_header, size):
+    """
+    Returns the (start, stop) spans of a file of `size` bytes asked for by
+    `range_header`. Returns None when the whole file should be sent (no,
+    invalid or too many ranges) and an empty list when no range can be
+    satisfied.
+    """
+    byte_range = parse_range_header(range_header)
+    if not byte_range or len(byte_range.ranges) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for start, stop in byte_range.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    return ranges
+
+
 class LocalFileAdapter(requests.adapters.HTTPAdapter):
+    """Serves file:// urls by streaming the file from disk.
+
+    The body is read from the open file as it is consumed, so memory use does
+    not depend on the file size. Range requests are answered with 206 Partial
+    Content, as a multipart/byteranges body when several ranges are asked
+    for, or with 416 when none of the ranges is in the file. The response
+    exposes the body as `local_file`, and `local_file.detach()` hands the open
+    file over to a new owner such as the WSGI file wrapper.
+    """
+
     def build_response_from_file(self, request):
         file_path = request.url[7:]
-        with open(file_path, "rb") as file:
-            buff = bytearray(os.path.getsize(file_path))
-            file.readinto(buff)
-            resp = Resp(buff)
+        file = open(file_path, "rb")
+        try:
+            size = os.fstat(file.fileno()).st_size
+            status, reason = 206, "Partial Content"
+            headers = {"Accept-Ranges": "bytes"}
+
+            ranges = get_byte_ranges(request.headers.get("Range"), size)
+            if ranges is None:
+                status, reason = 200, "OK"
+                body = FileSlice(file, size)
+            elif not ranges:
+                status, reason = 416, "Range Not Satisfiable"
+                headers["Content-Range"] = f"bytes */{size}"
+                body = FileSlice(file, 0)
+            elif len(ranges) == 1:
+                start, stop = ranges[0]
+                file.seek(start)
+                headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+                body = FileSlice(file, stop - start)
+            else:
+                boundary = uuid.uuid4().hex
+                headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+                body = FileRanges(file, ranges, size, boundary)
+
+            headers["Content-Length"] = str(body.length)
+            resp = HTTPResponse(
+                body=body,
+                headers=headers,
+                status=status,
+                reason=reason,
+                preload_content=False,
+                decode_content=False,
+            )
             r = self.build_response(request, resp)
+            r.local_file = body
+        except BaseException:
+            file.close()
+            raise
 
-            return r
+        return r
 
     def send(
         self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
@@ -121,6 +324,79 @@ class LocalFileAdapter(requests.adapters.HTTPAdapter):
         return self.build_response_from_file(request)
 
 
+_aquarius_clients = {}
+_ddo_cache = None
+_ddo_cache_config = None
+_ddo_flight = SingleFlight()
+
+
+class _DDONotFound:
+    """Negative cache entry, keeps the error raised by the metadata store."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def get_ddo_cache():
+    """Returns the process-wide DDO cache, created from the config on first use.
+
+    The cache is recreated, empty, when the config snapshot changes (e.g.
+    after `reload_config()`), so new sizes and TTLs apply.
+    """
+    global _ddo_cache, _ddo_cache_config
+    config = get_config()
+    if _ddo_cache is None or config is not _ddo_cache_config:
+        _ddo_cache = TTLCache(config.ddo_cache_max_entries, config.ddo_cache_ttl)
+        _ddo_cache_config = config
+
+    return _ddo_cache
+
+
 def get_asset_from_metadatastore(metadata_url, document_id):
-    aqua = Aquarius(metadata_url)
-    return aqua.get_asset_ddo(document_id)
+    """Returns the asset for `document_id`, served from the DDO cache when possible.
+
+    Concurrent cache misses for the same DID share a single request to the
+    metadata store. A 404 from the metadata store is cached for
+    `ddo_cache.negative_ttl` seconds and raised again as a `ValueError` on
+    every hit. Other errors, e.g. a 5xx or a connection error, are raised
+    without being cached.
+    The cached `Asset` is shared, callers must not mutate it.
+    """
+    key = (metadata_url, document_id)
+    cached = get_ddo_cache().get(key)
+    if isinstance(cached, _DDONotFound):
+        raise ValueError(cached.message)
+    if cached is not None:
+        return cached
+
+    return _ddo_flight.do(key, lambda: _fetch_asset(metadata_url, document_id))
+
+
+def _fetch_asset(metadata_url, document_id):
+    cache = get_ddo_cache()
+    key = (metadata_url, document_id)
+
+    aqua = _aquarius_clients.get(metadata_url)
+    if aqua is None:
+        aqua = _aquarius_clients.setdefault(metadata_url, Aquarius(metadata_url))
+
+    # same request as Aquarius.get_asset_ddo, which hides the status code
+    response = aqua.requests_session.get(f"{aqua.url}/{document_id}")
+    if response.status_code == 404:
+        message = response.text or f"Asset {document_id} not found."
+        cache.set(key, _DDONotFound(message), ttl=get_config().ddo_cache_negative_ttl)
+        raise ValueError(message)
+
+    response.raise_for_status()
+    try:
+        parsed_response = json.loads(response.content) if response.content else None
+    except ValueError:
+        raise ValueError(response.text)
+    if not parsed_response:
+        return {}
+
+    asset = DDO(dictionary=parsed_response)
+    cache.set(key, asset)
+
+    logger.debug(f"DDO cache miss for {document_id}, stats: {cache.stats()}")
+    return asset
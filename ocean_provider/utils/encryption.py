@@ -2,25 +2,88 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import ecies
 from ocean_lib.web3_internal.wallet import Wallet
 from ocean_provider.utils.accounts import get_private_key
+from ocean_provider.utils.basics import get_config
 from web3 import Web3
 
+_crypto_executor = None
+_crypto_executor_lock = threading.Lock()
+
+
+def get_crypto_executor():
+    """Returns the process pool for batched ECIES operations, None if disabled.
+
+    The pool is created on first use in each (gunicorn worker) process.
+    Children are spawned rather than forked, so they do not inherit the
+    locks held by the threads of the worker.
+    """
+    global _crypto_executor
+    workers = get_config().crypto_workers
+    if workers <= 0:
+        return None
+
+    with _crypto_executor_lock:
+        if _crypto_executor is None:
+            _crypto_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    return _crypto_executor
+
 
 def do_encrypt(document, wallet: Wallet = None, public_key=None):
     key = get_private_key(wallet).public_key.to_hex() if wallet else public_key
+    return _encrypt(key, document)
+
+
+def do_decrypt(encrypted_document, provider_wallet):
+    key = get_private_key(provider_wallet)
+    return _decrypt(key.to_hex(), encrypted_document)
+
+
+def do_encrypt_many(documents, wallet: Wallet = None, public_key=None):
+    """Encrypts a list of documents, in parallel when a crypto executor is set."""
+    key = get_private_key(wallet).public_key.to_hex() if wallet else public_key
+    return _map_with_key(_encrypt, key, documents)
+
+
+def do_decrypt_many(encrypted_documents, provider_wallet):
+    """Decrypts a list of documents, in parallel when a crypto executor is set.
+
+    Documents that cannot be decrypted are returned as None.
+    """
+    key = get_private_key(provider_wallet).to_hex()
+    return _map_with_key(_decrypt, key, encrypted_documents)
+
+
+def _map_with_key(fn, key, items):
+    items = list(items)
+    executor = get_crypto_executor() if len(items) > 1 else None
+    if executor is None:
+        return [fn(key, item) for item in items]
+
+    chunksize = max(1, len(items) // (get_config().crypto_workers * 4))
+    return list(executor.map(partial(fn, key), items, chunksize=chunksize))
+
+
+def _encrypt(key, document):
     encrypted_document = ecies.encrypt(key, document.encode(encoding="utf-8"))
 
     return Web3.toHex(encrypted_document)
 
 
-def do_decrypt(encrypted_document, provider_wallet):
-    key = get_private_key(provider_wallet)
+def _decrypt(key, encrypted_document):
     try:
-        return ecies.decrypt(
-            key.to_hex(), Web3.toBytes(hexstr=encrypted_document)
-        ).decode(encoding="utf-8")
+        return ecies.decrypt(key, Web3.toBytes(hexstr=encrypted_document)).decode(
+            encoding="utf-8"
+        )
     except Exception:
         return None
 
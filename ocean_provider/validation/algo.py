@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 from eth_utils import add_0x_prefix
+from ocean_provider.asset_context import AssetContext
 from ocean_provider.myapp import app
 from ocean_provider.serializers import StageAlgoSerializer
 from ocean_provider.util import (
@@ -10,25 +11,25 @@ from ocean_provider.util import (
     decode_from_data,
     filter_dictionary,
     filter_dictionary_starts_with,
-    get_asset_download_urls,
-    get_metadata_url,
     get_service_at_index,
     record_consume_request,
     validate_order,
     validate_transfer_not_used_for_other_service,
 )
-from ocean_provider.utils.basics import get_asset_from_metadatastore
 from ocean_utils.agreements.service_agreement import ServiceAgreement
 from ocean_utils.agreements.service_types import ServiceTypes
 from ocean_utils.did import did_to_id
 
 
 class WorkflowValidator:
-    def __init__(self, consumer_address, provider_wallet, data):
+    def __init__(self, consumer_address, provider_wallet, data, asset_context=None):
         """Initializes the validator."""
         self.consumer_address = consumer_address
         self.provider_wallet = provider_wallet
         self.data = data
+        self.asset_context = asset_context or AssetContext(
+            provider_wallet, app.config["CONFIG_FILE"]
+        )
         self.workflow = dict({"stages": []})
 
     def validate(self):
@@ -69,12 +70,21 @@ class WorkflowValidator:
         all_data = main_input + additional_inputs
         algo_data = filter_dictionary_starts_with(self.data, "algorithm")
 
+        self.asset_context.prefetch(
+            [item.get("documentId") for item in all_data if isinstance(item, dict)]
+            + [algo_data.get("algorithmDid")]
+        )
+
         self.validated_inputs = []
 
         for index, input_item in enumerate(all_data):
             input_item.update(algo_data)
             input_item_validator = InputItemValidator(
-                self.consumer_address, self.provider_wallet, input_item, index
+                self.consumer_address,
+                self.provider_wallet,
+                input_item,
+                index,
+                self.asset_context,
             )
 
             status = input_item_validator.validate()
@@ -119,7 +129,7 @@ class WorkflowValidator:
             algorithm_token_address = algo_data.get("algorithmDataToken")
             algorithm_tx_id = algo_data.get("algorithmTransferTxId")
 
-            algo = get_asset_from_metadatastore(get_metadata_url(), algorithm_did)
+            algo = self.asset_context.get_asset(algorithm_did)
             try:
                 asset_type = algo.metadata["main"]["type"]
             except ValueError:
@@ -161,7 +171,7 @@ class WorkflowValidator:
                 return False
 
         algorithm_dict = StageAlgoSerializer(
-            self.consumer_address, self.provider_wallet, algo_data
+            self.consumer_address, self.provider_wallet, algo_data, self.asset_context
         ).serialize()
 
         valid, error_msg = validate_formatted_algorithm_dict(
@@ -207,12 +217,17 @@ def validate_formatted_algorithm_dict(algorithm_dict, algorithm_did):
 
 
 class InputItemValidator:
-    def __init__(self, consumer_address, provider_wallet, data, index):
+    def __init__(
+        self, consumer_address, provider_wallet, data, index, asset_context=None
+    ):
         """Initializes the input item validator."""
         self.consumer_address = consumer_address
         self.provider_wallet = provider_wallet
         self.data = data
         self.index = index
+        self.asset_context = asset_context or AssetContext(
+            provider_wallet, app.config["CONFIG_FILE"]
+        )
 
     def validate(self):
         required_keys = ["documentId", "transferTxId"]
@@ -228,7 +243,7 @@ class InputItemValidator:
 
         self.did = self.data.get("documentId")
         try:
-            self.asset = get_asset_from_metadatastore(get_metadata_url(), self.did)
+            self.asset = self.asset_context.get_asset(self.did)
         except ValueError:
             self.error = f"Asset for did {self.did} not found."
             return False
@@ -250,9 +265,7 @@ class InputItemValidator:
             self.error = "Service for main asset must be compute."
             return False
 
-        asset_urls = get_asset_download_urls(
-            self.asset, self.provider_wallet, config_file=app.config["CONFIG_FILE"]
-        )
+        asset_urls = self.asset_context.get_asset_download_urls(self.asset)
 
         if self.service.type == ServiceTypes.CLOUD_COMPUTE and not asset_urls:
             self.error = "Services in input with compute type must be in the same provider you are calling."
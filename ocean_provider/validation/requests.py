@@ -132,6 +132,14 @@ class EncryptRequest(CustomJsonRequest):
         }
 
 
+class EncryptBatchRequest(CustomJsonRequest):
+    def rules(self):
+        return {
+            "documents": ["required", "array"],
+            "publisherAddress": ["required"],
+        }
+
+
 class FileInfoRequest(CustomJsonRequest):
     def rules(self):
         return {
@@ -140,6 +148,11 @@ class FileInfoRequest(CustomJsonRequest):
         }
 
 
+class ChecksumJobRequest(CustomJsonRequest):
+    def rules(self):
+        return {"jobId": ["required"]}
+
+
 class ComputeRequest(CustomJsonRequest):
     def rules(self):
         return {
@@ -179,7 +192,8 @@ class DownloadRequest(CustomJsonRequest):
             "dataToken": ["required"],
             "consumerAddress": ["bail", "required"],
             "transferTxId": ["bail", "required"],
-            "fileIndex": ["required"],
+            "fileIndex": ["required_without:archive"],
+            "archive": ["nullable", "in:zip,tar"],
             "signature": ["required", "download_signature:consumerAddress,documentId"],
         }
 
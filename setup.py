@@ -42,6 +42,9 @@ install_requirements = [
     "SQLAlchemy==1.3.23",
 ]
 
+# Required to serve with the gevent worker class:
+gevent_requirements = ["gevent>=20.9.0"]
+
 # Required to run setup.py:
 setup_requirements = ["pytest-runner"]
 
@@ -83,6 +86,7 @@ setup(
     ],
     description="🐳 Ocean Provider.",
     extras_require={
+        "gevent": gevent_requirements,
         "test": test_requirements,
         "dev": dev_requirements + test_requirements,
     },
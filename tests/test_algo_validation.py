@@ -2,7 +2,9 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+from unittest.mock import Mock, patch
 
+from ocean_provider.asset_context import AssetContext
 from ocean_provider.util import build_stage_output_dict
 from ocean_provider.utils.basics import get_provider_wallet
 from ocean_provider.validation.algo import WorkflowValidator
@@ -309,3 +311,29 @@ def test_fails(client):
         validator.error
         == f"Error in input at index 1: this algorithm did {alg_ddo.did} is not trusted."
     )
+
+
+def test_asset_context_fetches_and_decrypts_once():
+    asset = Mock(did="did:op:1")
+    context = AssetContext(get_provider_wallet(), None)
+
+    with patch(
+        "ocean_provider.asset_context.get_asset_from_metadatastore",
+        return_value=asset,
+    ) as get_asset, patch(
+        "ocean_provider.asset_context.get_asset_urls",
+        return_value=["https://a/0", "https://a/1"],
+    ) as get_urls, patch(
+        "ocean_provider.asset_context.get_download_url",
+        side_effect=lambda url, _: url,
+    ):
+        for _ in range(3):
+            assert context.get_asset("did:op:1") is asset
+            assert context.get_asset_url_at_index(1, asset) == "https://a/1"
+            assert context.get_asset_download_urls(asset) == [
+                "https://a/0",
+                "https://a/1",
+            ]
+
+    assert get_asset.call_count == 1
+    assert get_urls.call_count == 1
@@ -6,7 +6,14 @@
 import os
 import pathlib
 
-from ocean_provider.config import NAME_STORAGE_PATH, Config, environ_names
+import pytest
+from ocean_provider.config import (
+    NAME_AQUARIUS_URL,
+    NAME_STORAGE_PATH,
+    Config,
+    environ_names,
+)
+from ocean_provider.utils.basics import get_config, reload_config
 
 
 def test_config():
@@ -23,3 +30,37 @@ def test_config():
     os.environ[environ_names[NAME_STORAGE_PATH][0]] = "new-storage.db"
     _config = Config(test_config)
     assert _config.storage_path == "new-storage.db"
+
+
+def test_config_snapshot(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text("[resources]\naquarius.url = http://aqua-1\n")
+
+    _config = get_config(str(config_file))
+    assert get_config(str(config_file)) is _config
+    assert _config.aquarius_url == "http://aqua-1"
+
+    with pytest.raises(TypeError):
+        _config.set("resources", NAME_AQUARIUS_URL, "http://other")
+
+    config_file.write_text("[resources]\naquarius.url = http://aqua-2\n")
+    os.utime(config_file, ns=(0, 1))
+    _new_config = get_config(str(config_file))
+    assert _new_config is not _config
+    assert _new_config.aquarius_url == "http://aqua-2"
+
+    reload_config()
+    assert get_config(str(config_file)) is not _new_config
+
+
+def test_download_timeouts():
+    _config = Config(
+        text="[resources]\ndownload.read_timeout = 7\n"
+        "[download_timeouts]\namazonaws.com = 10,60\ns3.amazonaws.com = 20\n"
+    )
+
+    assert _config.get_download_timeouts("https://example.com/file") == (3, 7)
+    assert _config.get_download_timeouts("https://b.amazonaws.com/f") == (10, 60)
+    assert _config.get_download_timeouts("https://b.s3.amazonaws.com/f") == (20, 20)
+    assert _config.get_download_timeouts("https://notamazonaws.com/f") == (3, 7)
+    assert _config.download_max_duration is None
@@ -3,26 +3,55 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import email
+import gc
+import gzip
+import hashlib
+import io
 import mimetypes
+import os
+import tarfile
+import threading
+import time
+import zipfile
 from copy import deepcopy
-from unittest.mock import MagicMock, Mock
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from unittest.mock import MagicMock, Mock, patch
 
+import flask
+import pytest
+import requests
+import urllib3
 from ocean_lib.models.data_token import DataToken
 from ocean_lib.web3_internal.utils import add_ethereum_prefix_and_hash_msg
 from ocean_lib.web3_internal.web3helper import Web3Helper
 from ocean_provider.constants import BaseURLs
-from ocean_provider.exceptions import InvalidSignatureError
-from ocean_provider.util import build_download_response, get_download_url
+from ocean_provider.download_cache import DownloadCache
+from ocean_provider.exceptions import DownloadAbortedError, InvalidSignatureError
+from ocean_provider.myapp import app
+from ocean_provider.user_nonce import get_nonce as get_stored_nonce
+from ocean_provider.util import (
+    build_archive_response,
+    build_download_response,
+    get_download_url,
+    get_signed_url_expiry,
+    has_strong_validator,
+    iter_response_chunks,
+    iter_segmented_chunks,
+)
 from ocean_provider.utils.accounts import (
     check_auth_token,
     generate_auth_token,
     is_auth_token_valid,
     verify_signature,
 )
+from ocean_provider.utils.basics import LocalFileAdapter, get_provider_wallet
+from ocean_provider.utils.encryption import do_decrypt
 from ocean_utils.agreements.service_agreement import ServiceAgreement
 from ocean_utils.agreements.service_types import ServiceTypes
 from ocean_utils.aquarius.aquarius import Aquarius
 from ocean_utils.http_requests.requests_session import get_requests_session
+from requests_testadapter import Resp
 from tests.test_helpers import (
     get_consumer_wallet,
     get_dataset_ddo_with_access_service,
@@ -102,6 +131,28 @@ def test_download_service(client):
     response = client.get(request_url)
     assert response.status_code == 200, f"{response.data}"
 
+    # Consume the files as an archive, invalid file indices are rejected
+    nonce = get_nonce(client, cons_wallet.address)
+    _hash = add_ethereum_prefix_and_hash_msg(f"{ddo.did}{nonce}")
+    payload["signature"] = Web3Helper.sign_hash(_hash, cons_wallet)
+    payload.pop("fileIndex")
+    payload["archive"] = "zip"
+    for file_indices in ("0,a", "0,99"):
+        payload["fileIndices"] = file_indices
+        request_url = (
+            download_endpoint + "?" + "&".join([f"{k}={v}" for k, v in payload.items()])
+        )
+        response = client.get(request_url)
+        assert response.status_code == 400, f"{response.data}"
+
+    payload["fileIndices"] = "0"
+    request_url = (
+        download_endpoint + "?" + "&".join([f"{k}={v}" for k, v in payload.items()])
+    )
+    response = client.get(request_url)
+    assert response.status_code == 200, f"{response.data}"
+    assert response.mimetype == "application/zip"
+
 
 def test_empty_payload(client):
     consume = client.get(
@@ -115,6 +166,39 @@ def test_empty_payload(client):
     assert publish.status_code == 400
 
 
+def test_encrypt_batch(client):
+    pub_wallet = get_publisher_wallet()
+    nonce = int(get_stored_nonce(pub_wallet.address))
+    documents = [
+        {"documentId": f"did:op:{i}", "document": f'[{{"url": "https://a/{i}"}}]'}
+        for i in range(3)
+    ]
+    response = client.post(
+        BaseURLs.ASSETS_URL + "/encrypt/batch",
+        json={"documents": documents, "publisherAddress": pub_wallet.address},
+    )
+    assert response.status_code == 201, f"{response.data}"
+
+    result = response.json["encryptedDocuments"]
+    assert [item["documentId"] for item in result] == [
+        document["documentId"] for document in documents
+    ]
+    assert (
+        do_decrypt(result[1]["encryptedDocument"], get_provider_wallet())
+        == '[{"url":"https://a/1"}]'
+    )
+    assert int(get_stored_nonce(pub_wallet.address)) == nonce + 1
+
+    response = client.post(
+        BaseURLs.ASSETS_URL + "/encrypt/batch",
+        json={
+            "documents": [{"documentId": "did:op:0"}],
+            "publisherAddress": pub_wallet.address,
+        },
+    )
+    assert response.status_code == 400
+
+
 def test_auth_token():
     token = (
         "0x1d2741dee30e64989ef0203957c01b14f250f5d2f6ccb0"
@@ -149,7 +233,7 @@ def test_download_ipfs_file(client):
     download_url = get_download_url(url, None)
     requests_session = get_requests_session()
 
-    request = Mock()
+    request = Mock(headers={})
     request.range = None
 
     print(f"got ipfs download url: {download_url}")
@@ -160,8 +244,25 @@ def test_download_ipfs_file(client):
     assert response.data, f"got no data {response.data}"
 
 
+def test_get_signed_url_expiry():
+    assert (
+        get_signed_url_expiry(
+            "https://a.blob.core.windows.net/c/f?sv=2019-02-02&se=2021-03-01T12%3A00%3A00Z&sig=x"
+        )
+        == 1614600000
+    )
+    assert (
+        get_signed_url_expiry(
+            "https://s3.amazonaws.com/b/f?X-Amz-Date=20210301T120000Z&X-Amz-Expires=3600"
+        )
+        == 1614603600
+    )
+    assert get_signed_url_expiry("https://b.s3.amazonaws.com/f?Expires=1614600000")
+    assert get_signed_url_expiry("https://example.com/f?sig=x") is None
+
+
 def test_build_download_response():
-    request = Mock()
+    request = Mock(headers={})
     request.range = None
 
     class Dummy:
@@ -252,6 +353,427 @@ def test_build_download_response():
     )
 
 
+def test_iter_response_chunks():
+    content = bytes(range(256)) * 4096
+
+    response = requests.Response()
+    response.raw = urllib3.response.HTTPResponse(
+        body=io.BytesIO(content), preload_content=False
+    )
+    chunks = list(iter_response_chunks(response, 8192, 65536))
+    assert b"".join(chunks) == content
+    assert len(chunks[0]) == 8192
+    assert max(len(chunk) for chunk in chunks) == 65536
+
+    response = requests.Response()
+    response.raw = Resp(content)
+    chunks = list(iter_response_chunks(response, 8192, 8192))
+    assert b"".join(chunks) == content
+    assert len(chunks) == len(content) // 8192
+
+
+def test_iter_response_chunks_chunked_upstream():
+    content = bytes(range(256)) * 16384
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = content
+            self.send_response(200)
+            if self.path.endswith(".gz"):
+                body = gzip.compress(content)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(body), 100000):
+                part = body[start : start + 100000]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data"
+    try:
+        for path in ("/data.bin", "/data.bin.gz"):
+            response = requests.get(url + path, stream=True)
+            chunks = iter_response_chunks(response, 65536, 1024 * 1024)
+            assert b"".join(chunks) == content
+    finally:
+        server.shutdown()
+
+
+def test_iter_response_chunks_limits():
+    class SlowBody(io.RawIOBase):
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            time.sleep(0.2)
+            buffer[:10] = b"x" * 10
+            return 10
+
+    response = requests.Response()
+    response.raw = SlowBody()
+    with patch("ocean_provider.util.DOWNLOAD_STALL_WINDOW", 0.5):
+        with pytest.raises(DownloadAbortedError):
+            list(iter_response_chunks(response, 8192, 8192, min_speed=1000))
+    assert response.raw.closed
+
+    response = requests.Response()
+    response.raw = SlowBody()
+    with pytest.raises(DownloadAbortedError):
+        list(iter_response_chunks(response, 8192, 8192, max_duration=0.5))
+
+
+def test_local_file_adapter(tmp_path):
+    content = bytes(range(256)) * 64
+    path = tmp_path / "data.csv"
+    path.write_bytes(content)
+    session = requests.Session()
+    session.mount("file://", LocalFileAdapter())
+
+    response = session.get(f"file://{path}", stream=True)
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == str(len(content))
+    assert response.content == content
+
+    response = session.get(f"file://{path}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(content)}"
+    assert response.content == content[100:200]
+
+    url = "https://source-lllllll.cccc/data.csv"
+    with app.test_request_context(headers={"Range": "bytes=10-"}), patch(
+        "ocean_provider.util.is_safe_url", return_value=True
+    ):
+        response = build_download_response(
+            flask.request, session, url, f"file://{path}"
+        )
+        assert response.direct_passthrough
+        assert response.status_code == 206
+        assert response.headers["Content-Length"] == str(len(content) - 10)
+        body = response.get_app_iter(flask.request.environ)
+        del response
+        gc.collect()
+        assert b"".join(body) == content[10:]
+
+
+def test_local_file_adapter_ranges(tmp_path):
+    content = bytes(range(256)) * 64
+    path = tmp_path / "data.csv"
+    path.write_bytes(content)
+    session = requests.Session()
+    session.mount("file://", LocalFileAdapter())
+
+    response = session.get(f"file://{path}", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == content[-10:]
+
+    response = session.get(f"file://{path}", headers={"Range": "bytes=99999-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(content)}"
+    assert response.content == b""
+
+    response = session.get(
+        f"file://{path}", headers={"Range": "bytes=0-9,100-109,99999-"}
+    )
+    assert response.status_code == 206
+    content_type = response.headers["Content-Type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    assert int(response.headers["Content-Length"]) == len(response.content)
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + response.content
+    )
+    parts = message.get_payload()
+    assert [part["Content-Range"] for part in parts] == [
+        f"bytes 0-9/{len(content)}",
+        f"bytes 100-109/{len(content)}",
+    ]
+    assert [part.get_payload(decode=True) for part in parts] == [
+        content[0:10],
+        content[100:110],
+    ]
+
+
+def test_build_download_response_conditional():
+    content = b"ocean" * 1000
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                return
+            body = gzip.compress(content) if "gzip" in self.path else content
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", '"v1"')
+            self.send_header("Last-Modified", "Mon, 01 Mar 2021 12:00:00 GMT")
+            self.send_header("Accept-Ranges", "bytes")
+            if "gzip" in self.path:
+                self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def download(path, headers=None):
+        with app.test_request_context(headers=headers), patch(
+            "ocean_provider.util.is_safe_url", return_value=True
+        ):
+            response = build_download_response(
+                flask.request, requests.Session(), base_url + path, base_url + path
+            )
+            return response, b"".join(response.response)
+
+    try:
+        response, body = download("/data.csv")
+        assert response.status_code == 200 and body == content
+        assert response.headers["ETag"] == '"v1"'
+        assert response.headers["Last-Modified"] == "Mon, 01 Mar 2021 12:00:00 GMT"
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["Content-Length"] == str(len(content))
+
+        response, body = download("/data.csv", {"If-None-Match": '"v1"'})
+        assert response.status_code == 304 and body == b""
+        assert response.headers["ETag"] == '"v1"'
+
+        response, body = download("/data.csv.gzip")
+        assert body == content
+        assert "Content-Length" not in response.headers
+    finally:
+        server.shutdown()
+
+    assert requests_seen[1]["If-None-Match"] == '"v1"'
+
+
+def test_iter_segmented_chunks():
+    files = {"etag": '"v1"', "content": bytes(range(256)) * 1000, "stall": 0}
+    ranges_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = files["content"]
+            byte_range = self.headers.get("Range")
+            if byte_range and self.headers.get("If-Range") == files["etag"]:
+                start, stop = map(int, byte_range[6:].split("-"))
+                ranges_seen.append((start, stop))
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{stop}/{len(content)}"
+                )
+                content = content[start : stop + 1]
+                stall = files["stall"] if start == 60000 else 0
+            else:
+                self.send_response(200)
+                self.send_header("Accept-Ranges", "bytes")
+                stall = 0
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", files["etag"])
+            self.end_headers()
+            self.wfile.write(content[:1000])
+            self.wfile.flush()
+            time.sleep(stall)
+            self.wfile.write(content[1000:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.bin"
+    session = requests.Session()
+    try:
+        response = session.get(url, stream=True)
+        chunks = list(iter_segmented_chunks(session, url, response, 3, 30000))
+        assert b"".join(chunks) == files["content"]
+        assert [len(chunk) for chunk in chunks[-8:]] == [30000] * 7 + [16000]
+        assert sorted(ranges_seen)[0] == (30000, 59999)
+
+        response = session.get(url, stream=True)
+        files["stall"] = 2
+        with patch("ocean_provider.util.DOWNLOAD_STALL_WINDOW", 0.5):
+            with pytest.raises(DownloadAbortedError):
+                list(
+                    iter_segmented_chunks(
+                        session, url, response, 3, 30000, min_speed=100000
+                    )
+                )
+        files["stall"] = 0
+
+        response = session.get(url, stream=True)
+        files["etag"] = '"v2"'
+        with pytest.raises(DownloadAbortedError):
+            list(iter_segmented_chunks(session, url, response, 3, 30000))
+    finally:
+        server.shutdown()
+
+
+def test_has_strong_validator():
+    assert has_strong_validator({"ETag": '"v1"'})
+    assert not has_strong_validator({"ETag": 'W/"v1"'})
+    assert not has_strong_validator(
+        {"ETag": 'W/"v1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    )
+    assert has_strong_validator({"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    assert not has_strong_validator({})
+
+
+def test_build_archive_response(tmp_path):
+    contents = [bytes(range(256)) * 64, b"a,b\n1,2\n", b"log line\n" * 1000]
+    for directory, content in zip(("one", "two"), contents):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "data.csv").write_bytes(content)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.endswith("missing"):
+                self.send_error(404)
+                return
+            # no Content-Length, the body ends when the connection is closed
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(contents[2])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = requests.Session()
+    session.mount("file://", LocalFileAdapter())
+    stream_url = f"http://127.0.0.1:{server.server_address[1]}/logs/"
+    files = [
+        ("https://source-lllllll.cccc/one/data.csv", f"file://{tmp_path}/one/data.csv"),
+        ("https://source-lllllll.cccc/two/data.csv", f"file://{tmp_path}/two/data.csv"),
+        ("https://source-lllllll.cccc/logs/", stream_url),
+    ]
+    names = ["data.csv", "1_data.csv", "file2"]
+    try:
+        with patch("ocean_provider.util.is_safe_url", return_value=True):
+            response = build_archive_response(session, files, "zip", "asset.zip")
+            assert response.mimetype == "application/zip"
+            assert (
+                response.headers["Content-Disposition"]
+                == "attachment;filename=asset.zip"
+            )
+            archive = zipfile.ZipFile(io.BytesIO(b"".join(response.response)))
+            assert archive.namelist() == names
+            assert [archive.read(name) for name in names] == contents
+
+            response = build_archive_response(session, files, "tar", "asset.tar")
+            assert response.mimetype == "application/x-tar"
+            archive = tarfile.open(fileobj=io.BytesIO(b"".join(response.response)))
+            assert archive.getnames() == names
+            assert [archive.extractfile(name).read() for name in names] == contents
+
+            files.append(
+                ("https://source-lllllll.cccc/missing", stream_url + "missing")
+            )
+            response = build_archive_response(session, files, "zip", "asset.zip")
+            with pytest.raises(DownloadAbortedError):
+                b"".join(response.response)
+    finally:
+        server.shutdown()
+
+
+def test_download_cache(tmp_path):
+    files = {"etag": '"v1"', "content": b"ocean" * 1000}
+    gets = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            gets.append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == files["etag"]:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(files["content"])))
+            self.send_header("ETag", files["etag"])
+            self.end_headers()
+            self.wfile.write(files["content"])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.csv"
+    cache = DownloadCache(str(tmp_path), 1024 * 1024)
+
+    def download(headers=None):
+        with app.test_request_context(headers=headers), patch(
+            "ocean_provider.util.is_safe_url", return_value=True
+        ), patch("ocean_provider.util.get_download_cache", return_value=cache):
+            response = build_download_response(
+                flask.request, requests.Session(), url, url
+            )
+            return response, b"".join(response.response)
+
+    try:
+        response, body = download()
+        assert body == files["content"] and not response.direct_passthrough
+        assert cache.get(url)["validators"] == ('"v1"', None, "5000")
+
+        response, body = download()
+        assert body == files["content"] and response.direct_passthrough
+        assert response.headers["Content-Type"] == "text/csv"
+
+        response, body = download({"Range": "bytes=0-9"})
+        assert response.status_code == 206 and body == files["content"][:10]
+
+        files.update(etag='"v2"', content=b"other" * 1000)
+        response, body = download()
+        assert body == files["content"] and not response.direct_passthrough
+        assert cache.get(url)["validators"][0] == '"v2"'
+    finally:
+        server.shutdown()
+
+    assert gets == [None, '"v1"', '"v1"', '"v1"']
+
+
+def test_download_cache_eviction(tmp_path):
+    stale = tmp_path / "aborted.tmp"
+    stale.write_bytes(b"x" * 100)
+    os.utime(stale, (0, 0))
+    cache = DownloadCache(str(tmp_path), 2500)
+    urls = [f"https://files.example.com/{i}.csv" for i in range(3)]
+
+    for i, url in enumerate(urls):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers.update({"ETag": f'"{i}"', "Content-Length": "1000"})
+        assert b"".join(cache.store(url, response, [b"x" * 1000])) == b"x" * 1000
+        time.sleep(0.01)
+        if i == 1:
+            # the first entry becomes the most recently used
+            assert cache.get(urls[0])
+
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) and cache.get(urls[2])
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [
+        ".data",
+        ".data",
+        ".json",
+        ".json",
+    ]
+
+
 def test_asset_info(client):
     pub_wallet = get_publisher_wallet()
     asset = get_dataset_ddo_with_access_service(client, pub_wallet)
@@ -301,6 +823,29 @@ def test_check_url_good(client):
         assert file_info["valid"] is True
 
 
+def test_checksum_job_types(client):
+    url = "https://s3.amazonaws.com/testfiles.oceanprotocol.com/info.0.json"
+    content = requests.get(url).content
+    data = {"url": url, "checksumJob": True, "checksumTypes": "md5,sha256"}
+    response = client.post(BaseURLs.ASSETS_URL + "/fileinfo", json=data)
+    assert response.status_code == 200
+    job_id = response.get_json()[0]["checksumJobId"]
+
+    for _ in range(100):
+        response = client.get(BaseURLs.ASSETS_URL + f"/checksum?jobId={job_id}")
+        job = response.get_json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.1)
+
+    assert job["status"] == "done", job["error"]
+    assert job["checksums"] == {
+        "md5": hashlib.md5(content).hexdigest(),
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+    assert job["bytesHashed"] == len(content)
+
+
 def test_check_url_bad(client):
     request_url = BaseURLs.ASSETS_URL + "/fileinfo"
     data = {"url": "http://127.0.0.1/not_valid"}
@@ -2,7 +2,46 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
-from ocean_provider.util_url import is_safe_schema, is_safe_url
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from unittest.mock import MagicMock, Mock, patch
+
+import dns.resolver
+import pytest
+import requests
+from ocean_provider.checksum_jobs import get_checksum_job, start_checksum_job
+from ocean_provider.exceptions import ChecksumJobQueueFullError
+from ocean_provider.url_checksum import (
+    get_url_checksum,
+    get_validators,
+    store_url_checksum,
+)
+from ocean_provider.util import get_asset_files_list
+from ocean_provider.util_url import (
+    SafeAddressAdapter,
+    _get_records,
+    _get_result_from_url,
+    check_urls_details,
+    is_safe_domain,
+    is_safe_schema,
+    is_safe_url,
+)
+from ocean_provider.utils.basics import (
+    get_asset_from_metadatastore,
+    get_ddo_cache,
+    get_provider_wallet,
+    reload_config,
+)
+from ocean_provider.utils.cache import SingleFlight, TTLCache
+from ocean_provider.utils.encryption import (
+    do_decrypt,
+    do_decrypt_many,
+    do_encrypt,
+    do_encrypt_many,
+)
 
 
 def test_is_safe_schema():
@@ -17,3 +56,436 @@ def test_is_safe_url():
     assert is_safe_url("127.0.0.1") is False
     assert is_safe_url("169.254.169.254") is False
     assert is_safe_url("http://169.254.169.254/latest/meta-data/hostname") is False
+
+
+def test_ttl_cache():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+    cache.set("d", 4, ttl=-1)
+    assert cache.get("d") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "size": 2}
+
+
+def test_get_asset_from_metadatastore_is_cached():
+    def aquarius_response(status_code, content):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        return response
+
+    aquarius = MagicMock(url="http://aqua/api/v1/aquarius/assets/ddo")
+    get = aquarius.requests_session.get
+    get.side_effect = lambda url: aquarius_response(
+        200, b'{"id": "%s"}' % url.rpartition("/")[2].encode()
+    )
+
+    with patch("ocean_provider.utils.basics._ddo_cache", None), patch(
+        "ocean_provider.utils.basics._aquarius_clients", {"aqua": aquarius}
+    ):
+        assert get_asset_from_metadatastore("aqua", "did:op:1").did == "did:op:1"
+        assert get_asset_from_metadatastore("aqua", "did:op:1").did == "did:op:1"
+        assert get.call_count == 1
+
+        # only a 404 is cached
+        get.side_effect = lambda url: aquarius_response(404, b"Asset not found")
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                get_asset_from_metadatastore("aqua", "did:op:2")
+        assert get.call_count == 2
+
+        get.side_effect = lambda url: aquarius_response(503, b"")
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.HTTPError):
+                get_asset_from_metadatastore("aqua", "did:op:3")
+        assert get.call_count == 4
+
+        get.side_effect = requests.exceptions.ConnectionError
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                get_asset_from_metadatastore("aqua", "did:op:4")
+        assert get.call_count == 6
+
+        # new config, new cache
+        cache = get_ddo_cache()
+        reload_config()
+        assert get_ddo_cache() is not cache
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(flight.do, "did:op:1", fetch) for _ in range(8)]
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_get_asset_files_list_is_cached():
+    asset = Mock(did="did:op:1", encrypted_files="0x1234")
+    wallet = Mock(address="0xprovider")
+
+    with patch(
+        "ocean_provider.util.do_decrypt", return_value='[{"url": "https://a"}]'
+    ) as decrypt:
+        for _ in range(3):
+            assert get_asset_files_list(asset, wallet) == [{"url": "https://a"}]
+        assert decrypt.call_count == 1
+
+        rotated_wallet = Mock(address="0xrotated")
+        get_asset_files_list(asset, rotated_wallet)
+        assert decrypt.call_count == 2
+
+
+def test_encrypt_decrypt_many():
+    wallet = get_provider_wallet()
+    documents = [f'[{{"url": "https://a/{i}"}}]' for i in range(4)]
+
+    encrypted = do_encrypt_many(documents, wallet)
+    assert len(encrypted) == len(documents)
+    assert do_decrypt(encrypted[2], wallet) == documents[2]
+    assert do_decrypt_many(encrypted + ["0x00"], wallet) == documents + [None]
+    assert do_decrypt_many([do_encrypt(documents[0], wallet)], wallet) == [documents[0]]
+
+
+def test_get_records_caches_nxdomain():
+    resolver = Mock()
+    resolver.resolve.side_effect = dns.resolver.NXDOMAIN()
+
+    with patch("ocean_provider.util_url._dns_resolver", resolver), patch(
+        "ocean_provider.util_url._dns_negative_cache", TTLCache(10, 60)
+    ):
+        assert _get_records("unknown.invalid", "A") is None
+        assert _get_records("unknown.invalid", "A") is None
+        assert resolver.resolve.call_count == 1
+
+
+def test_is_safe_domain_caches_verdict():
+    class Answer(list):
+        expiration = time.time() + 60
+
+    records = {"A": Answer(["93.184.216.34"]), "AAAA": Answer(["10.0.0.1"])}
+
+    with patch("ocean_provider.util_url._dns_resolver", Mock()), patch(
+        "ocean_provider.util_url._dns_executor", ThreadPoolExecutor()
+    ), patch("ocean_provider.util_url._safe_domain_cache", TTLCache(10, 60)), patch(
+        "ocean_provider.util_url._get_records",
+        side_effect=lambda domain, record_type: records[record_type],
+    ) as get_records:
+        for _ in range(3):
+            assert is_safe_domain("files.example.com") is False
+        assert get_records.call_count == 2
+
+
+def test_safe_address_adapter():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", f"http://127.0.0.1:{port}/data.csv")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            body = self.headers["Host"].encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    session = requests.Session()
+    session.mount("http://", SafeAddressAdapter())
+    try:
+        with patch(
+            "ocean_provider.util_url.get_safe_addresses", return_value=["127.0.0.1"]
+        ):
+            response = session.get(f"http://files.example.com:{port}/data.csv")
+            assert response.text == f"files.example.com:{port}"
+
+        with patch("ocean_provider.util_url.get_safe_addresses", return_value=None):
+            with pytest.raises(requests.exceptions.InvalidURL):
+                session.get(f"http://files.example.com:{port}/data.csv")
+
+        # nothing listens on 127.0.0.2, the next address is used
+        with patch(
+            "ocean_provider.util_url.get_safe_addresses",
+            return_value=["127.0.0.2", "127.0.0.1"],
+        ):
+            response = session.get(f"http://files.example.com:{port}/data.csv")
+            assert response.text == f"files.example.com:{port}"
+
+        # redirects to ip addresses are validated too
+        with patch(
+            "ocean_provider.util_url.get_safe_addresses", return_value=["127.0.0.1"]
+        ), patch(
+            "ocean_provider.util_url.get_config",
+            return_value=Mock(allow_non_public_ip=False),
+        ):
+            with pytest.raises(requests.exceptions.InvalidURL):
+                session.get(f"http://files.example.com:{port}/redirect")
+    finally:
+        server.shutdown()
+
+
+def test_check_urls_details_keeps_order():
+    def check(url, **kwargs):
+        time.sleep(0.3 - 0.1 * int(url[-1]))
+        return True, {"url": url}
+
+    urls = [f"https://a/{i}" for i in range(3)]
+    with patch("ocean_provider.util_url.check_url_details", side_effect=check):
+        start = time.time()
+        results = check_urls_details(urls)
+
+    assert time.time() - start < 0.5
+    assert [details["url"] for _, details in results] == urls
+
+
+def test_check_urls_details_deadline():
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(100 * 1024 * 1024))
+            self.end_headers()
+
+        def do_GET(self):
+            self.do_HEAD()
+            try:
+                for _ in range(5000):
+                    self.wfile.write(b"x" * 8192)
+                    time.sleep(0.02)
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    executor = ThreadPoolExecutor(max_workers=1)
+    config = Mock(fileinfo_timeout=0.5, get_download_timeouts=lambda url: (3, 3))
+    try:
+        with patch("ocean_provider.util_url.get_config", return_value=config), patch(
+            "ocean_provider.util_url._fileinfo_executor", executor
+        ), patch("ocean_provider.util_url.is_safe_url", return_value=True), patch(
+            "ocean_provider.util_url.get_safe_addresses", return_value=["127.0.0.1"]
+        ):
+            start = time.time()
+            results = check_urls_details(
+                [f"http://files.example.com:{server.server_address[1]}/slow.txt"],
+                with_checksum=True,
+            )
+            assert results == [(False, {})]
+
+            # the check running at the deadline stops instead of hashing the
+            # whole file
+            executor.shutdown(wait=True)
+            assert time.time() - start < 2
+    finally:
+        server.shutdown()
+
+
+def test_get_result_from_url_probes():
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            requests_seen.append("HEAD")
+            self.send_response(501)
+            self.end_headers()
+
+        def do_OPTIONS(self):
+            requests_seen.append("OPTIONS")
+            self.send_response(501)
+            self.end_headers()
+
+        def do_GET(self):
+            requests_seen.append(self.headers["Range"])
+            self.send_response(206)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Range", "bytes 0-0/12345")
+            self.send_header("Content-Length", "1")
+            self.end_headers()
+            self.wfile.write(b"a")
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with patch(
+            "ocean_provider.util_url.get_safe_addresses", return_value=["127.0.0.1"]
+        ):
+            status_code, headers, _ = _get_result_from_url(
+                f"http://files.example.com:{server.server_address[1]}/data.csv"
+            )
+    finally:
+        server.shutdown()
+
+    assert requests_seen == ["HEAD", "OPTIONS", "bytes=0-0"]
+    assert status_code == 200
+    assert headers["Content-Length"] == "12345"
+    assert headers["Content-Type"] == "text/csv"
+
+
+def test_get_result_from_url_single_pass_checksums():
+    content = b"ocean" * 100000
+    gets = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+
+        def do_GET(self):
+            gets.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with patch(
+            "ocean_provider.util_url.get_safe_addresses", return_value=["127.0.0.1"]
+        ):
+            status_code, _, details = _get_result_from_url(
+                f"http://files.example.com:{server.server_address[1]}/data.txt",
+                with_checksum=True,
+                checksum_types=["md5", "sha256", "blake2b"],
+            )
+    finally:
+        server.shutdown()
+
+    assert status_code == 200
+    assert len(gets) == 1
+    assert details["checksumType"] == "md5"
+    assert details["checksum"] == hashlib.md5(content).hexdigest()
+    assert details["checksums"] == {
+        "md5": hashlib.md5(content).hexdigest(),
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "blake2b": hashlib.blake2b(content).hexdigest(),
+    }
+
+
+def test_url_checksum_store():
+    url = f"https://files.example.com/{time.time()}.csv"
+    validators = get_validators(
+        {"ETag": '"abc"', "Last-Modified": "Mon, 01 Mar 2021 12:00:00 GMT"}
+    )
+    assert get_validators({"Content-Length": "10"}) is None
+    assert get_url_checksum(url, "sha256", validators) is None
+
+    store_url_checksum(url, "sha256", validators, "0xchecksum")
+    assert get_url_checksum(url, "sha256", validators) == "0xchecksum"
+    assert get_url_checksum(url, "md5", validators) is None
+
+    changed_validators = ('"def"',) + validators[1:]
+    assert get_url_checksum(url, "sha256", changed_validators) is None
+
+
+def test_checksum_job():
+    def compute(url, checksum_types, progress_callback):
+        # a failed progress update does not fail the job
+        response = Mock(headers={"Content-Length": "not a length"})
+        progress_callback(response, 512)
+        return response, {t: "0xchecksum" for t in checksum_types}, 1024
+
+    with patch(
+        "ocean_provider.checksum_jobs.compute_url_checksums", side_effect=compute
+    ):
+        job_id = start_checksum_job("https://files.example.com/large.csv")
+        for _ in range(50):
+            job = get_checksum_job(job_id)
+            if job["status"] == "done":
+                break
+            time.sleep(0.1)
+
+    assert job["checksums"] == {"sha256": "0xchecksum"}
+    assert job["bytesHashed"] == job["totalBytes"] == 1024
+    assert "url" not in job
+    assert get_checksum_job("unknown") is None
+
+    with patch(
+        "ocean_provider.checksum_jobs.compute_url_checksums",
+        side_effect=requests.exceptions.HTTPError("404 Client Error"),
+    ):
+        job_id = start_checksum_job("https://files.example.com/missing.csv")
+        for _ in range(50):
+            job = get_checksum_job(job_id)
+            if job["status"] == "failed":
+                break
+            time.sleep(0.1)
+
+    assert job["error"] == "404 Client Error"
+
+
+def test_checksum_job_queue():
+    release = threading.Event()
+
+    def compute(url, checksum_types, progress_callback):
+        release.wait(5)
+        return Mock(headers={}), {t: "0xchecksum" for t in checksum_types}, 1024
+
+    def wait_for(job_id, status):
+        for _ in range(50):
+            job = get_checksum_job(job_id)
+            if job["status"] == status:
+                return job
+            time.sleep(0.1)
+
+    with patch(
+        "ocean_provider.checksum_jobs.compute_url_checksums", side_effect=compute
+    ), patch(
+        "ocean_provider.checksum_jobs._executor", ThreadPoolExecutor(max_workers=1)
+    ), patch(
+        "ocean_provider.checksum_jobs._pending_slots", threading.BoundedSemaphore(1)
+    ):
+        running_id = start_checksum_job("https://files.example.com/a.csv")
+        assert wait_for(running_id, "running")
+        pending_id = start_checksum_job("https://files.example.com/b.csv")
+
+        # active jobs are reused, only new ones need a free slot
+        assert start_checksum_job("https://files.example.com/a.csv") == running_id
+        assert start_checksum_job("https://files.example.com/b.csv") == pending_id
+        with pytest.raises(ChecksumJobQueueFullError):
+            start_checksum_job("https://files.example.com/c.csv")
+        with pytest.raises(ChecksumJobQueueFullError):
+            start_checksum_job("https://files.example.com/a.csv", ["md5"])
+
+        release.set()
+        assert wait_for(pending_id, "done")
+        assert start_checksum_job("https://files.example.com/b.csv") != pending_id